@@ -1,16 +1,27 @@
 # audio2images.py
+import multiprocessing
 import runpy
 import sys
 import os
 
+# worker processes of the bundled executable (wav2png.py --jobs) start by running this script too
+multiprocessing.freeze_support()
+
+# "audio2images serve ..." starts a render server, "audio2images client ..." renders on one,
+# anything else is passed to wav2png.py
+scripts = {"serve": "render_server.py", "client": "render_client.py"}
+script = "wav2png.py"
+if len(sys.argv) > 1 and sys.argv[1] in scripts:
+    script = scripts[sys.argv.pop(1)]
+
 # Set arguments to pass through
-sys.argv = ["wav2png.py"] + sys.argv[1:]
+sys.argv = [script] + sys.argv[1:]
 
 # Get correct path whether running source or bundled
 if hasattr(sys, "_MEIPASS"):
-    script_path = os.path.join(sys._MEIPASS, "wav2png.py")
+    script_path = os.path.join(sys._MEIPASS, script)
 else:
-    script_path = os.path.abspath("wav2png.py")
+    script_path = os.path.abspath(script)
 
 # Run the script
 runpy.run_path(script_path, run_name="__main__")
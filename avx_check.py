@@ -4,22 +4,69 @@ import platform
 import subprocess
 import sys
 
-def has_avx():
-    """Check for AVX support using CPUID instruction on Windows"""
-    # This only works on Intel/AMD x86 CPUs
-    if platform.machine().lower() not in ['x86_64', 'amd64', 'i386', 'i686']:
-        return False
+# IsProcessorFeaturePresent features, see winnt.h
+PF_AVX_INSTRUCTIONS_AVAILABLE = 39
+PF_AVX2_INSTRUCTIONS_AVAILABLE = 40
+PF_AVX512F_INSTRUCTIONS_AVAILABLE = 41
+
+
+def is_x86():
+    return platform.machine().lower() in ['x86_64', 'amd64', 'i386', 'i686']
+
+
+def numpy_cpu_features():
+    """The features NumPy detected, if it is imported already (importing it is what may crash)"""
+    for name in ("numpy._core._multiarray_umath", "numpy.core._multiarray_umath"):
+        features = getattr(sys.modules.get(name), "__cpu_features__", None)
+        if features:
+            return {feature.lower() for feature, present in features.items() if present}
+    return None
+
 
+def os_cpu_features():
+    """The features the operating system reports, without installing or importing anything big"""
+    if sys.platform == "win32":
+        present = ctypes.windll.kernel32.IsProcessorFeaturePresent
+        return {feature for feature, pf in (("avx", PF_AVX_INSTRUCTIONS_AVAILABLE),
+                                            ("avx2", PF_AVX2_INSTRUCTIONS_AVAILABLE),
+                                            ("avx512f", PF_AVX512F_INSTRUCTIONS_AVAILABLE)) if present(pf)}
+    if sys.platform.startswith("linux"):
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+        return None
+    if sys.platform == "darwin":
+        output = subprocess.run(["sysctl", "-n", "machdep.cpu.features", "machdep.cpu.leaf7_features"],
+                                capture_output=True, text=True).stdout
+        return {feature.lower() for feature in output.split()} or None
+    return None
+
+
+def cpu_features():
+    """
+    The lower case feature flags of the CPU ("avx", "avx2", ...), None if they can't be told. Asks
+    NumPy if it is imported, py-cpuinfo if it is installed, the operating system otherwise
+    """
+    if not is_x86():
+        return None
+    features = numpy_cpu_features()
+    if features is not None:
+        return features
     try:
         import cpuinfo
+        return set(cpuinfo.get_cpu_info().get("flags", []))
     except ImportError:
-        print("Installing py-cpuinfo...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "py-cpuinfo"])
-        import cpuinfo
+        pass
+    try:
+        return os_cpu_features()
+    except (OSError, AttributeError):
+        return None
+
 
-    info = cpuinfo.get_cpu_info()
-    flags = info.get("flags", [])
-    return "avx" in flags
+def has_avx():
+    """Check for AVX support (only Intel/AMD x86 CPUs have it)"""
+    return "avx" in (cpu_features() or ())
 
 def test_import_numpy():
     try:
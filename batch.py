@@ -0,0 +1,172 @@
+# batch.py
+# Render many files at once on a pool of worker processes, see wav2png.py --jobs
+
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import soundfile as sf
+
+from processing import create_wave_images, SequentialReader, ANALYSIS_BLOCK_SIZE, DRAW_BLOCK_SIZE, PREFETCH_DEPTH
+from render_stats import RenderStats
+
+# memory a worker process takes before rendering anything (python, numpy, PIL, soundfile)
+WORKER_BASE_MEMORY = 64 * 1024 * 1024
+
+# with profile, the stats (see render_stats.RenderStats.as_dict) of the job are in its result. With an
+# export_file, the analysis data is written to it too (see export.py), output_file_w may then be None.
+# With variants (variants.OutputSpecs) those images are rendered instead of output_file_w and _s, the
+# size being the one of the widest of them
+RenderJob = namedtuple("RenderJob", ["input_file", "output_file_w", "output_file_s", "image_width",
+                                     "image_height", "fft_size", "color_scheme", "profile", "export_file",
+                                     "export_format", "export_rows", "variants"],
+                       defaults=(False, None, "binary", None, None))
+RenderResult = namedtuple("RenderResult", ["job", "error", "seconds", "stats"], defaults=(None,))
+
+
+def estimate_memory(image_width, image_height, fft_size, channels=2):
+    """ rough upper bound of the memory create_wave_images needs for one file, in bytes """
+    n_bins = fft_size // 2 + 1
+    spectra = image_width * n_bins * 8  # raw spectra of all columns
+    features = min(image_width, DRAW_BLOCK_SIZE) * n_bins * 8 * 3  # normalized and db spectra of one block
+    # the buffers of the block analysed, the ones prefetched and the one being read (left channel
+    # only, see SequentialReader), frames and FFTs, plus the chunk all channels are decoded into
+    analysis = ANALYSIS_BLOCK_SIZE * 4 * (PREFETCH_DEPTH + 2 + 6) + SequentialReader.CHUNK_SIZE * channels * 4
+    images = image_width * image_height * (3 + 4) * 2  # both pixel arrays and their PIL copies
+    return WORKER_BASE_MEMORY + spectra + features + analysis + images
+
+
+def warm_up():
+    """ does nothing, but a worker running it has imported this module and with it numpy, PIL,
+    soundfile and processing, see render_server.py """
+    return os.getpid()
+
+
+def render_job(job):
+    """ render one job, catching its errors so they can be reported per file """
+    start = time.perf_counter()
+    stats = RenderStats() if job.profile else None
+    try:
+        if job.variants:
+            from variants import create_variant_images
+            # one thread, the other processes of the batch use the other CPUs
+            create_variant_images(job.input_file, job.variants, job.fft_size, stats=stats, workers=1)
+        else:
+            create_wave_images(job.input_file, job.output_file_w, job.output_file_s, job.image_width,
+                               job.image_height, job.fft_size, color_scheme=job.color_scheme, stats=stats,
+                               export_filename=job.export_file, export_format=job.export_format,
+                               export_rows=job.export_rows)
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return RenderResult(job, error, time.perf_counter() - start, stats.as_dict() if stats else None)
+
+
+def run_batch(jobs, n_jobs=None, max_memory=None, result_callback=None):
+    """
+    Render jobs on n_jobs worker processes (os.cpu_count() if None) and return their RenderResults
+    in the order they finished. The longest files are started first, so the batch doesn't end
+    waiting for a long file started last. If max_memory (bytes) is given, jobs are only started
+    while the estimated memory of all running jobs stays below it (a job that needs more than
+    max_memory on its own still runs, alone). result_callback is called with every RenderResult
+    as soon as it is available. A worker process dying fails just the job it was rendering, the
+    pool is replaced and the other jobs are rendered on the new one.
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    pending = []
+    for job in jobs:
+        try:
+            info = sf.info(job.input_file)
+            duration, channels = info.duration, info.channels
+        except Exception:
+            # unreadable headers fail fast in the worker, where the error is reported
+            duration, channels = 0, 1
+        memory = estimate_memory(job.image_width, job.image_height, job.fft_size, channels)
+        pending.append((duration, memory, job))
+
+    # longest first, pop() takes from the end
+    pending.sort(key=lambda p: p[0])
+
+    results = []
+
+    def report(result):
+        results.append(result)
+        if result_callback:
+            result_callback(result)
+
+    # (memory, job) of the jobs that were running when a worker process died (crashed, or was killed
+    # for running out of memory). Which of them it was working on is unknown, so each of them is
+    # run once more on its own: the one whose worker dies then is the one reported as failed
+    suspects = []
+    running = {}
+
+    def collect_broken():
+        """ wait for the jobs running on a broken pool, report the ones that finished before it
+        broke and return (memory, job, error) of the ones it took down """
+        lost = []
+        wait(running)
+        for future, (memory, job) in running.items():
+            try:
+                report(future.result())
+            except BrokenProcessPool as e:
+                lost.append((memory, job, f"{type(e).__name__}: {e}"))
+            except Exception as e:
+                report(RenderResult(job, f"{type(e).__name__}: {e}", 0.0))
+        running.clear()
+        return lost
+
+    executor = ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        while pending or suspects or running:
+            broken = False
+            if suspects:
+                if not running:
+                    memory, job = suspects.pop()
+                    try:
+                        running[executor.submit(render_job, job)] = (memory, job)
+                    except BrokenProcessPool:
+                        suspects.append((memory, job))
+                        broken = True
+            while not broken and not suspects and pending and len(running) < n_jobs:
+                duration, memory, job = pending[-1]
+                running_memory = sum(m for m, _ in running.values())
+                if max_memory is not None and running and running_memory + memory > max_memory:
+                    break
+                try:
+                    future = executor.submit(render_job, job)
+                except BrokenProcessPool:
+                    broken = True
+                    break
+                pending.pop()
+                running[future] = (memory, job)
+
+            if not broken:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        break
+                    except Exception as e:
+                        result = RenderResult(running[future][1], f"{type(e).__name__}: {e}", 0.0)
+                    running.pop(future)
+                    report(result)
+
+            if broken:
+                lost = collect_broken()
+                if len(lost) == 1:
+                    # the only job running, its worker is the one that died
+                    _, job, error = lost[0]
+                    report(RenderResult(job, error, 0.0))
+                else:
+                    suspects.extend((memory, job) for memory, job, _ in lost)
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=n_jobs)
+    finally:
+        executor.shutdown()
+
+    return results
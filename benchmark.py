@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# benchmark.py
+# Reproducible benchmarks of the processing pipeline.
+#
+#   python benchmark.py run results.json              time every stage on every input and grid point
+#   python benchmark.py compare before.json after.json  list the stages that got slower
+#
+# The inputs are generated from fixed seeds (sine sweeps, noise and silence at different sample
+# rates, channel counts, durations and formats) into --inputs-dir, plus TestSound.ogg. Every stage
+# is timed on its own, --repeat times, keeping the fastest run (the one least disturbed by the rest
+# of the machine) and the median.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy
+import soundfile as sf
+
+from fft_backend import describe_backend, use_backend, FFT_BACKENDS
+from processing import (AudioProcessor, WaveformImage, SpectrogramImage, analyze_audio, get_max_level,
+                        DRAW_BLOCK_SIZE)
+
+RESULTS_VERSION = 1
+
+# name: (signal, sample rate, channels, seconds, format, subtype)
+SYNTHETIC_INPUTS = {
+    "sweep_44k_mono_16.wav": ("sweep", 44100, 1, 30, "WAV", "PCM_16"),
+    "sweep_96k_stereo_24.wav": ("sweep", 96000, 2, 10, "WAV", "PCM_24"),
+    "sweep_48k_stereo_float.wav": ("sweep", 48000, 2, 10, "WAV", "FLOAT"),
+    "noise_48k_stereo.flac": ("noise", 48000, 2, 30, "FLAC", "PCM_16"),
+    "noise_22k_mono.ogg": ("noise", 22050, 1, 30, "OGG", "VORBIS"),
+    "sweep_44k_stereo_long.ogg": ("sweep", 44100, 2, 300, "OGG", "VORBIS"),
+    "silence_44k_mono_16.wav": ("silence", 44100, 1, 10, "WAV", "PCM_16"),
+    "sweep_8k_mono_short.wav": ("sweep", 8000, 1, 1, "WAV", "PCM_16"),
+}
+
+WRITE_BLOCK_SIZE = 64 * 1024
+
+DEFAULT_WIDTHS = [500, 1800]
+DEFAULT_HEIGHTS = [171, 501]
+DEFAULT_FFT_SIZES = [512, 2048]
+
+
+def synthesize(signal, samplerate, channels, seconds, seed=0):
+    """ seconds of signal ("sweep", "noise" or "silence"), the same for the same arguments """
+    n = int(samplerate * seconds)
+    if signal == "silence":
+        return numpy.zeros((n, channels), dtype=numpy.float32)
+
+    if signal == "noise":
+        rng = numpy.random.default_rng(seed)
+        return (rng.standard_normal((n, channels)) * 0.25).clip(-1, 1).astype(numpy.float32)
+
+    # exponential sweep from 20 Hz to just below nyquist, every channel a little later than the last
+    t = numpy.arange(n) / float(samplerate)
+    f0, f1 = 20.0, samplerate * 0.45
+    k = numpy.log(f1 / f0) / seconds
+    sweep = numpy.empty((n, channels), dtype=numpy.float32)
+    for channel in range(channels):
+        phase = 2 * numpy.pi * f0 * (numpy.exp(k * (t + channel * 0.01)) - 1) / k
+        sweep[:, channel] = 0.8 * numpy.sin(phase)
+    return sweep
+
+
+def generate_inputs(inputs_dir, names=None):
+    """ write the synthetic inputs (all of them, or those in names) that aren't there yet, returns
+    their filenames """
+    os.makedirs(inputs_dir, exist_ok=True)
+    filenames = []
+    for name, (signal, samplerate, channels, seconds, file_format, subtype) in SYNTHETIC_INPUTS.items():
+        if names and name not in names:
+            continue
+        filename = os.path.join(inputs_dir, name)
+        if not os.path.exists(filename):
+            samples = synthesize(signal, samplerate, channels, seconds)
+            # written a block at a time, the Vorbis encoder of libsndfile crashes on very large writes
+            temporary_filename = filename + ".tmp"
+            with sf.SoundFile(temporary_filename, "w", samplerate, channels, subtype, format=file_format) as f:
+                for start in range(0, len(samples), WRITE_BLOCK_SIZE):
+                    f.write(samples[start:start + WRITE_BLOCK_SIZE])
+            os.replace(temporary_filename, filename)
+        filenames.append(filename)
+    return filenames
+
+
+def time_stage(function, repeat):
+    """ (fastest, median) seconds of repeat calls of function """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def seek_points(processor, image_width):
+    samples_per_pixel = processor.nframes / float(image_width)
+    return (numpy.arange(image_width + 1) * samples_per_pixel).astype(numpy.int64)
+
+
+def benchmark_analysis(input_filename, image_width, fft_size, repeat):
+    """ {stage: (fastest, median)} of the stages that don't depend on the image height """
+    processor = AudioProcessor(input_filename, fft_size, numpy.hanning, normalize=False)
+    try:
+        points = seek_points(processor, image_width)
+
+        def centroids():
+            for x in range(image_width):
+                processor.spectral_centroid(points[x])
+
+        def peaks():
+            for x in range(image_width):
+                processor.peaks(points[x], points[x + 1])
+
+        return {
+            "get_max_level": time_stage(lambda: get_max_level(input_filename), repeat),
+            "analyze_audio": time_stage(lambda: analyze_audio(processor, image_width), repeat),
+            # the column at a time API, on the normalization analyze_audio left behind
+            "spectral_centroid": time_stage(centroids, repeat),
+            "peaks": time_stage(peaks, repeat),
+        }
+    finally:
+        processor.audio_file.close()
+
+
+def benchmark_images(input_filename, image_width, image_height, fft_size, color_scheme, repeat, output_dir):
+    """ {stage: (fastest, median)} of drawing and saving both images """
+    processor = AudioProcessor(input_filename, fft_size, numpy.hanning, normalize=False)
+    try:
+        all_peaks, raw_spectra = analyze_audio(processor, image_width)
+    finally:
+        processor.audio_file.close()
+
+    features = [processor.spectrum_features(raw_spectra[x0:x0 + DRAW_BLOCK_SIZE])
+                for x0 in range(0, image_width, DRAW_BLOCK_SIZE)]
+    images = {}
+
+    def draw_waveform():
+        images["waveform"] = WaveformImage(image_width, image_height, color_scheme)
+        for block, (spectral_centroids, _) in enumerate(features):
+            x0 = block * DRAW_BLOCK_SIZE
+            images["waveform"].draw_columns(x0, all_peaks[x0:x0 + DRAW_BLOCK_SIZE], spectral_centroids)
+
+    def draw_spectrogram():
+        images["spectrogram"] = SpectrogramImage(image_width, image_height, fft_size, color_scheme, processor.samplerate)
+        for block, (_, db_spectra) in enumerate(features):
+            images["spectrogram"].draw_spectra(block * DRAW_BLOCK_SIZE, db_spectra)
+
+    def save():
+        images["waveform"].save(os.path.join(output_dir, "benchmark_w.png"))
+        images["spectrogram"].save(os.path.join(output_dir, "benchmark_s.jpg"))
+
+    return {
+        "WaveformImage": time_stage(draw_waveform, repeat),
+        "SpectrogramImage": time_stage(draw_spectrogram, repeat),
+        "save": time_stage(save, repeat),
+    }
+
+
+def environment():
+    """ what the results were measured on """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "soundfile": sf.__version__,
+        "libsndfile": sf.__libsndfile_version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "fft_backend": describe_backend(),
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run(args):
+    print(f"FFT backend: {use_backend(args.fft_backend)}")
+    inputs = generate_inputs(args.inputs_dir, args.inputs)
+    test_sound = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TestSound.ogg")
+    if os.path.exists(test_sound) and (not args.inputs or "TestSound.ogg" in args.inputs):
+        inputs.append(test_sound)
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for input_filename in inputs:
+            name = os.path.basename(input_filename)
+            for fft_size in args.fft_sizes:
+                for image_width in args.widths:
+                    print(f"{name} {image_width}px fft {fft_size}")
+                    timings = [(None, benchmark_analysis(input_filename, image_width, fft_size, args.repeat))]
+                    for image_height in args.heights:
+                        timings.append((image_height, benchmark_images(input_filename, image_width, image_height,
+                                                                       fft_size, args.color_scheme, args.repeat,
+                                                                       output_dir)))
+                    for image_height, stages in timings:
+                        for stage, (fastest, median) in stages.items():
+                            results.append({"input": name, "stage": stage, "width": image_width,
+                                            "height": image_height, "fft_size": fft_size,
+                                            "seconds": fastest, "median": median})
+                            print(f"\t{stage:<18} {'' if image_height is None else image_height:>5} {fastest:9.4f}s")
+
+    with open(args.output, "w") as f:
+        json.dump({"version": RESULTS_VERSION, "environment": environment(), "repeat": args.repeat,
+                   "results": results}, f, indent=1)
+    print(f"results written to {args.output}")
+
+
+def result_key(result):
+    return result["input"], result["stage"], result["width"], result["height"], result["fft_size"]
+
+
+def compare(args):
+    """ print how every stage changed from the baseline results to the new ones, returns the number
+    of regressions: stages more than threshold percent slower """
+    with open(args.baseline) as f:
+        baseline = {result_key(result): result for result in json.load(f)["results"]}
+    with open(args.results) as f:
+        results = json.load(f)["results"]
+
+    regressions = 0
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        change = 100.0 * (result["seconds"] - before["seconds"]) / before["seconds"] if before["seconds"] else 0.0
+        # changes of very fast stages are mostly noise
+        significant = max(result["seconds"], before["seconds"]) >= args.min_seconds
+        flag = ""
+        if significant and change > args.threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        elif significant and change < -args.threshold:
+            flag = "faster"
+        if flag or args.verbose:
+            input_name, stage, width, height, fft_size = result_key(result)
+            print(f"{input_name:<28} {stage:<18} {width:>5}x{'' if height is None else height:<5} fft {fft_size:<5} "
+                  f"{before['seconds']:9.4f}s -> {result['seconds']:9.4f}s {change:+7.1f}% {flag}")
+
+    print(f"{regressions} regressions beyond {args.threshold}%")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and save the results")
+    run_parser.add_argument("output", help="JSON file to write the results to")
+    run_parser.add_argument("--inputs-dir", default=os.path.join(tempfile.gettempdir(), "audio2images_benchmark"),
+                            help="directory to generate the synthetic inputs in (reused by later runs)")
+    run_parser.add_argument("--inputs", nargs="+", default=None,
+                            help="only benchmark these inputs, one of: " + ", ".join(SYNTHETIC_INPUTS) +
+                                 ", TestSound.ogg")
+    run_parser.add_argument("--widths", type=int, nargs="+", default=DEFAULT_WIDTHS)
+    run_parser.add_argument("--heights", type=int, nargs="+", default=DEFAULT_HEIGHTS)
+    run_parser.add_argument("--fft-sizes", type=int, nargs="+", default=DEFAULT_FFT_SIZES, dest="fft_sizes")
+    run_parser.add_argument("-c", "--color_scheme", default="Freesound2", dest="color_scheme")
+    run_parser.add_argument("--repeat", type=int, default=3, help="runs of every stage, the fastest counts")
+    run_parser.add_argument("--fft-backend", choices=FFT_BACKENDS, default="auto", dest="fft_backend",
+                            help="FFT to benchmark, see fft_backend.py")
+
+    compare_parser = commands.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline", help="results to compare against")
+    compare_parser.add_argument("results", help="new results")
+    compare_parser.add_argument("--threshold", type=float, default=10.0,
+                                help="flag stages that got more than this many percent slower")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.005, dest="min_seconds",
+                                help="ignore changes of stages faster than this")
+    compare_parser.add_argument("-v", "--verbose", action="store_true", help="list unchanged stages too")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(1 if compare(args) else 0)
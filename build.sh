@@ -40,10 +40,28 @@ build() {
     --hidden-import=os \
     --hidden-import=traceback \
     --hidden-import=functools \
+    --hidden-import=importlib \
+    --hidden-import=colorsys \
     --hidden-import=math \
     --hidden-import=re \
     --hidden-import=subprocess \
     --hidden-import=argparse \
+    --hidden-import=multiprocessing \
+    --hidden-import=concurrent.futures \
+    --hidden-import=json \
+    --hidden-import=struct \
+    --hidden-import=hashlib \
+    --hidden-import=zlib \
+    --hidden-import=shutil \
+    --hidden-import=fnmatch \
+    --hidden-import=signal \
+    --hidden-import=ctypes \
+    --hidden-import=platform \
+    --hidden-import=hmac \
+    --hidden-import=secrets \
+    --hidden-import=ipaddress \
+    --hidden-import=http.server \
+    --hidden-import=urllib.request \
     --hidden-import=numpy \
     --hidden-import=soundfile \
     --hidden-import=PIL \
@@ -51,6 +69,21 @@ build() {
     --hidden-import=PIL.ImageDraw \
     --add-data "color_schemes.py;." \
     --add-data "processing.py;." \
+    --add-data "batch.py;." \
+    --add-data "sidecar.py;." \
+    --add-data "render_cache.py;." \
+    --add-data "pcm_reader.py;." \
+    --add-data "streaming.py;." \
+    --add-data "tiles.py;." \
+    --add-data "render_stats.py;." \
+    --add-data "render_server.py;." \
+    --add-data "render_client.py;." \
+    --add-data "export.py;." \
+    --add-data "watch_folder.py;." \
+    --add-data "progress.py;." \
+    --add-data "variants.py;." \
+    --add-data "avx_check.py;." \
+    --add-data "fft_backend.py;." \
     --add-data "LICENSE.txt;." \
     --add-data "wav2png.py;." 
 
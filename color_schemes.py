@@ -21,10 +21,9 @@
 #     qubodup made this 'portable' kind of
 #
 
+from colorsys import hls_to_rgb
 from functools import partial
 
-from PIL import ImageColor
-
 def desaturate(rgb, amount):
     """
         desaturate colors by amount
@@ -39,7 +38,9 @@ def desaturate(rgb, amount):
 
 def color_from_value(value):
     """ given a value between 0 and 1, return an (r,g,b) tuple """
-    return ImageColor.getrgb("hsl(%d,%d%%,%d%%)" % (int((1.0 - value) * 360), 80, 50))
+    # what PIL.ImageColor.getrgb("hsl(%d,80%%,50%%)") returns, without importing PIL for every scheme
+    rgb = hls_to_rgb(int((1.0 - value) * 360) / 360.0, 0.5, 0.8)
+    return tuple(int(channel * 255 + 0.5) for channel in rgb)
 
 FREESOUND2_COLOR_SCHEME = 'Freesound2'
 BEASTWHOOSH_COLOR_SCHEME = 'FreesoundBeastWhoosh'
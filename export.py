@@ -0,0 +1,159 @@
+# export.py
+# Compact analysis data of the columns of a render, so a client (e.g. a web player) can draw the
+# waveform and spectrogram itself instead of downloading the images. See create_wave_images
+# (export_filename=...) and wav2png.py --export
+#
+# The values are the ones the images are drawn from, quantized:
+#   peaks        int8 (width, 2): first and second peak of every column, times 127 (samples are -1..1)
+#   centroids    uint8 (width,): spectral centroid of every column scaled to 0..255, the index into
+#                the 256 waveform colors of the color scheme
+#   spectrogram  uint8 (width, rows): value of every row of every column, the index into the 256
+#                spectrogram colors. The rows are log spaced from min_frequency to max_frequency,
+#                lowest first, like the pixel rows of a spectrogram image rows high (whose pixels
+#                they are exactly). There may be less rows than asked for with small FFTs
+#
+# File layout (.a2d, little endian):
+#   magic b"A2D\0", version (uint16), reserved (uint16), header length (uint32)
+#   JSON header: samplerate, frames, fft_size, width, rows, frequency range, max level and for every
+#                array its dtype, shape, and offset (from the end of the header) and size of its data
+#   the data of the arrays, each zlib compressed (what DecompressionStream("deflate") reads in a
+#   browser). The spectrogram is delta coded before: every row stores the difference (mod 256) to
+#   the row below it, so the values are the running sums along the rows of a column
+# With the JSON format (.json) the header holds the arrays themselves, as plain lists of numbers.
+
+import json
+import os
+import struct
+import zlib
+
+import numpy
+
+EXPORT_MAGIC = b"A2D\0"
+EXPORT_VERSION = 1
+
+# spectrogram rows of an export, a client stretches them to the height it draws at
+EXPORT_ROWS = 64
+
+_PREAMBLE = struct.Struct("<4sHHI")
+
+
+def quantize_peaks(peaks):
+    return numpy.rint(numpy.clip(peaks, -1.0, 1.0) * 127.0).astype(numpy.int8)
+
+
+def quantize_centroids(centroids):
+    # truncated like the color lookup of WaveformImage does
+    return (numpy.asarray(centroids) * 255.0).astype(numpy.uint8)
+
+
+def delta_encode(values):
+    """ every row (the last axis) as the difference to the one before it, mod 256 """
+    return numpy.diff(values, axis=-1, prepend=numpy.uint8(0))
+
+
+def delta_decode(deltas):
+    return numpy.cumsum(deltas, axis=-1, dtype=numpy.uint8)
+
+
+class AnalysisExport:
+    """
+    Collects the quantized values of the columns while they are drawn (see draw_images) and writes
+    them. spectrogram is a SpectrogramImage (of any width) whose pixel rows are the rows of the
+    spectrogram values, None to leave the spectrogram out.
+    """
+
+    def __init__(self, processor, all_peaks, spectrogram=None):
+        self.processor = processor
+        self.peaks = quantize_peaks(all_peaks)
+        self.centroids = numpy.zeros(len(all_peaks), dtype=numpy.uint8)
+        self.spectrogram = spectrogram
+        self.values = None
+        if spectrogram is not None:
+            self.values = numpy.zeros((len(all_peaks), len(spectrogram.bin_indices)), dtype=numpy.uint8)
+
+    def add_columns(self, x, spectral_centroids, values=None):
+        """ the spectral centroids and (with a spectrogram) spectrum_values of the columns x, x + 1, ... """
+        self.centroids[x:x + len(spectral_centroids)] = quantize_centroids(spectral_centroids)
+        if self.values is not None:
+            self.values[x:x + len(values)] = values
+
+    def header(self):
+        header = {
+            "version": EXPORT_VERSION,
+            "samplerate": self.processor.samplerate,
+            "frames": self.processor.nframes,
+            "fft_size": self.processor.fft_size,
+            "width": len(self.peaks),
+            "max_level": float(self.processor.max_level),
+            "peak_scale": 1.0 / 127.0,
+        }
+        if self.spectrogram is not None:
+            header.update({"rows": self.values.shape[1], "min_frequency": self.spectrogram.f_min,
+                           "max_frequency": self.spectrogram.f_max})
+        return header
+
+    def arrays(self):
+        arrays = {"peaks": self.peaks, "centroids": self.centroids}
+        if self.values is not None:
+            arrays["spectrogram"] = self.values
+        return arrays
+
+    def save(self, filename, format="binary"):
+        """ write the export to filename, format being "binary" or "json" """
+        temporary_filename = filename + ".tmp"
+        if format == "json":
+            document = self.header()
+            document.update({name: array.tolist() for name, array in self.arrays().items()})
+            with open(temporary_filename, "w") as f:
+                json.dump(document, f, separators=(",", ":"))
+        else:
+            self.write_binary(temporary_filename)
+        os.replace(temporary_filename, filename)
+
+    def write_binary(self, filename):
+        header = self.header()
+        header["arrays"] = {}
+
+        data = []
+        offset = 0
+        for name, array in self.arrays().items():
+            info = {"dtype": array.dtype.name, "shape": list(array.shape), "compression": "zlib"}
+            if name == "spectrogram":
+                array = delta_encode(array)
+                info["filter"] = "delta"
+            data.append(zlib.compress(numpy.ascontiguousarray(array).tobytes(), 9))
+            info.update({"offset": offset, "size": len(data[-1])})
+            header["arrays"][name] = info
+            offset += len(data[-1])
+
+        encoded_header = json.dumps(header).encode("utf-8")
+        with open(filename, "wb") as f:
+            f.write(_PREAMBLE.pack(EXPORT_MAGIC, EXPORT_VERSION, 0, len(encoded_header)))
+            f.write(encoded_header)
+            for chunk in data:
+                f.write(chunk)
+
+
+def load_export(filename):
+    """ (header, {name: array}) of an export written by AnalysisExport.save, in either format """
+    with open(filename, "rb") as f:
+        data = f.read()
+
+    if data[:4] != EXPORT_MAGIC:
+        document = json.loads(data)
+        dtypes = {"peaks": numpy.int8, "centroids": numpy.uint8, "spectrogram": numpy.uint8}
+        arrays = {name: numpy.array(document.pop(name), dtype=dtype) for name, dtype in dtypes.items()
+                  if name in document}
+        return document, arrays
+
+    magic, version, _, header_length = _PREAMBLE.unpack_from(data)
+    if version != EXPORT_VERSION:
+        raise ValueError(f"{filename}: unsupported export version {version}")
+    start = _PREAMBLE.size + header_length
+    header = json.loads(data[_PREAMBLE.size:start])
+    arrays = {}
+    for name, info in header.pop("arrays").items():
+        chunk = zlib.decompress(data[start + info["offset"]:start + info["offset"] + info["size"]])
+        array = numpy.frombuffer(chunk, dtype=info["dtype"]).reshape(info["shape"])
+        arrays[name] = delta_decode(array) if info.get("filter") == "delta" else array
+    return header, arrays
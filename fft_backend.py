@@ -0,0 +1,137 @@
+# fft_backend.py
+# The FFT the spectra of the analysis frames are computed with (see AudioProcessor.frame_spectra):
+# numpy.fft, or scipy.fft where it is installed. scipy's transforms a block of frames several at a
+# time with SIMD instructions, and can spread them over threads (workers=). The backend is chosen
+# once per process, by the name in the environment variable FFT_BACKEND_VARIABLE (set by wav2png.py
+# --fft-backend, so its worker processes use the same one) or, for "auto", by the CPU (see
+# avx_check.cpu_features):
+#
+#   - x86 CPUs without AVX get numpy.fft, scipy isn't even imported there: builds of it that are
+#     newer than the CPU crash the process on import instead of raising an error (see avx_check.py)
+#   - the others get scipy.fft if it can be imported, numpy.fft if it can't. scipy is optional and
+#     never installed automatically (pip install scipy)
+#
+# Frames are transformed in float32 by both (numpy since 2.0, older versions compute in float64).
+# That is plenty for the 110 dB the spectrogram shows: the spectra differ from float64 ones by less
+# than a twentieth of a pixel value. Both cache the plans of the sizes they transform, the fixed
+# fft_size is planned once per process.
+
+import os
+import threading
+
+import numpy
+
+from avx_check import cpu_features, is_x86
+
+FFT_BACKEND_VARIABLE = "WAV2PNG_FFT_BACKEND"
+FFT_BACKENDS = ("auto", "numpy", "scipy")
+
+
+def cpu_level(features):
+    """ the widest vector instructions among features, for describing the choice """
+    if features is None:
+        return "unknown CPU" if is_x86() else "not x86"
+    for feature in ("avx512f", "avx2", "avx"):
+        if feature in features:
+            return feature.upper()
+    return "no AVX"
+
+
+def default_threads():
+    """ one per CPU, but just one in worker processes (--jobs, --file-workers, render_server.py),
+    the other processes use the other CPUs """
+    import multiprocessing
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return os.cpu_count() or 1
+
+
+class NumpyFFT:
+    """ numpy.fft.rfft, into an output buffer per thread that is reused where numpy has out= (2.0) """
+
+    name = "numpy"
+
+    def __init__(self):
+        self.threads = 1
+        self.has_out = numpy.lib.NumpyVersion(numpy.__version__) >= "2.0.0"
+        self.buffers = threading.local()
+
+    def rfft(self, frames):
+        """ the rfft of every row of frames (float32), only valid until the next call on this thread """
+        if not self.has_out:
+            return numpy.fft.rfft(frames, axis=-1)
+        shape = (frames.shape[0], frames.shape[1] // 2 + 1)
+        size = shape[0] * shape[1]
+        buffer = getattr(self.buffers, "out", None)
+        if buffer is None or len(buffer) < size:
+            buffer = self.buffers.out = numpy.empty(size, dtype=numpy.complex64)
+        return numpy.fft.rfft(frames, axis=-1, out=buffer[:size].reshape(shape))
+
+
+class ScipyFFT:
+    """ scipy.fft.rfft on threads threads """
+
+    name = "scipy"
+
+    def __init__(self, threads):
+        import scipy.fft
+        self.fft = scipy.fft
+        self.threads = threads
+
+    def rfft(self, frames):
+        """ the rfft of every row of frames (float32) """
+        return self.fft.rfft(frames, axis=-1, workers=self.threads)
+
+
+def select_backend(name="auto", threads=None):
+    """
+    The backend called name (one of FFT_BACKENDS), scipy's on threads threads (see default_threads
+    if None). Raises ValueError for unknown names and ImportError if scipy is asked for but can't
+    be imported. Returns (backend, why it was chosen).
+    """
+    if name not in FFT_BACKENDS:
+        raise ValueError(f"unknown FFT backend {name!r}, one of {', '.join(FFT_BACKENDS)}")
+    threads = threads or default_threads()
+    features = cpu_features()
+    level = cpu_level(features)
+
+    if name == "numpy":
+        return NumpyFFT(), f"asked for, {level}"
+    if name == "scipy":
+        return ScipyFFT(threads), f"asked for, {level}"
+
+    if is_x86() and features is not None and "avx" not in features:
+        return NumpyFFT(), f"{level}, scipy is not tried"
+    try:
+        return ScipyFFT(threads), level
+    except ImportError:
+        return NumpyFFT(), f"{level}, scipy is not installed"
+
+
+# (process id, backend, why it was chosen) of the backend selected last. Forked worker processes
+# select their own, with their own number of threads
+_selected = None
+
+
+def fft_backend():
+    """ the backend of this process, selected on first use """
+    global _selected
+    if _selected is None or _selected[0] != os.getpid():
+        _selected = (os.getpid(),) + select_backend(os.environ.get(FFT_BACKEND_VARIABLE) or "auto")
+    return _selected[1]
+
+
+def use_backend(name, threads=None):
+    """ select the backend of this process and of the processes it starts, see select_backend.
+    Returns its description """
+    global _selected
+    _selected = (os.getpid(),) + select_backend(name, threads)
+    os.environ[FFT_BACKEND_VARIABLE] = name
+    return describe_backend()
+
+
+def describe_backend():
+    """ which backend this process uses and why, like "scipy.fft on 4 threads (AVX2)" """
+    backend = fft_backend()
+    threads = f" on {backend.threads} threads" if backend.threads > 1 else ""
+    return f"{backend.name}.fft{threads} ({_selected[2]})"
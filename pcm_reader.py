@@ -0,0 +1,200 @@
+# pcm_reader.py
+# Memory mapped reading of uncompressed WAV and AIFF files. The sample data is mapped as it is on
+# disk, channels are strided views into it and samples are only converted to float where needed,
+# instead of being decoded (and copied) through libsndfile for every read.
+
+import struct
+
+import numpy
+
+
+class PCMFormatError(ValueError):
+    pass
+
+
+# WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT and WAVE_FORMAT_EXTENSIBLE (whose sub format GUID starts
+# with one of the former)
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# AIFF-C compression types of uncompressed data, by byte order and sample type
+_AIFC_COMPRESSION = {
+    b"NONE": (">", "int"),
+    b"twos": (">", "int"),
+    b"sowt": ("<", "int"),
+    b"fl32": (">", "float"),
+    b"FL32": (">", "float"),
+    b"fl64": (">", "float"),
+    b"FL64": (">", "float"),
+}
+
+
+def _read_chunks(data, offset, end, byte_order):
+    """ yield (id, data offset, size) of the chunks between offset and end """
+    header = struct.Struct(byte_order + "4sI")
+    while offset + header.size <= end:
+        chunk_id, size = header.unpack_from(data, offset)
+        yield chunk_id, offset + header.size, size
+        offset += header.size + size + (size & 1)
+
+
+def _extended_to_float(data):
+    """ the 80 bit IEEE 754 extended float AIFF stores its sample rate in """
+    exponent, mantissa = struct.unpack(">HQ", data)
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    return sign * mantissa * 2.0 ** (exponent - 16383 - 63)
+
+
+class PCMFile:
+    """
+    An uncompressed WAV or AIFF file mapped into memory. Has the attributes of a soundfile.SoundFile
+    AudioProcessor uses (samplerate, channels, format, subtype, len()), and reads the left channel
+    with left_channel (raw samples) and read_left (float32, like libsndfile would return them).
+    Raises PCMFormatError for anything that isn't plain uncompressed audio.
+    """
+
+    def __init__(self, filename):
+        self.name = filename
+        with open(filename, "rb") as f:
+            # the headers of both formats are small, the data is mapped separately below
+            header = f.read(64 * 1024)
+            f.seek(0, 2)
+            file_size = f.tell()
+
+        if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+            layout = self._parse_wav(header)
+        elif header[:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+            layout = self._parse_aiff(header, header[8:12] == b"AIFC")
+        else:
+            raise PCMFormatError(f"{filename} is not a WAV or AIFF file")
+
+        data_offset, data_size, byte_order, sample_type, bits = layout
+        if self.channels < 1 or bits not in (8, 16, 24, 32, 64):
+            raise PCMFormatError(f"unsupported sample format in {filename}")
+
+        self.sample_bytes = bits // 8
+        block_align = self.sample_bytes * self.channels
+        # broken headers often claim more data than there is
+        data_size = max(0, min(data_size, file_size - data_offset))
+        self.frames = data_size // block_align
+        if self.frames == 0:
+            raise PCMFormatError(f"no audio data in {filename}")
+
+        self._data = numpy.memmap(filename, dtype=numpy.uint8, mode="r", offset=data_offset,
+                                  shape=(self.frames * block_align,))
+        frames = self._data.reshape(self.frames, self.channels, self.sample_bytes)
+
+        if sample_type == "float":
+            self.subtype = "FLOAT" if bits == 32 else "DOUBLE"
+            self._channels = frames.view(byte_order + "f%d" % self.sample_bytes)[..., 0]
+            self._scale = None
+        elif bits == 24:
+            self.subtype = "PCM_24"
+            # no numpy type for these, they are assembled into int32 when read
+            self._channels = frames
+            self._byte_order = byte_order
+            self._scale = numpy.float32(2.0 ** -23)
+        else:
+            unsigned = bits == 8 and self.format == "WAV"
+            self.subtype = "PCM_U8" if unsigned else ("PCM_S8" if bits == 8 else "PCM_%d" % bits)
+            dtype = byte_order + ("u" if unsigned else "i") + str(self.sample_bytes)
+            self._channels = frames.view(dtype)[..., 0]
+            self._scale = numpy.float32(2.0 ** (1 - bits))
+
+        self._offset = 128 if self.subtype == "PCM_U8" else 0
+        # whether distinct raw samples stay distinct as float32, so comparing raw samples (to find
+        # peaks, say) gives the same result as comparing converted ones
+        self.exact_float = self.subtype not in ("PCM_32", "DOUBLE")
+        self.position = 0
+
+    def _parse_wav(self, header):
+        self.format = "WAV"
+        fmt = None
+        for chunk_id, offset, size in _read_chunks(header, 12, len(header), "<"):
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack_from("<HHIIHH", header, offset)
+                format_tag = fmt[0]
+                if format_tag == _WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                    format_tag = struct.unpack_from("<H", header, offset + 24)[0]
+            elif chunk_id == b"data" and fmt is not None:
+                _, self.channels, self.samplerate, _, _, bits = fmt
+                if format_tag == _WAVE_FORMAT_PCM:
+                    return offset, size, "<", "int", bits
+                if format_tag == _WAVE_FORMAT_IEEE_FLOAT:
+                    return offset, size, "<", "float", bits
+                raise PCMFormatError(f"compressed WAV data (format {format_tag}) in {self.name}")
+        raise PCMFormatError(f"no fmt and data chunks in {self.name}")
+
+    def _parse_aiff(self, header, compressed):
+        self.format = "AIFF"
+        comm = None
+        for chunk_id, offset, size in _read_chunks(header, 12, len(header), ">"):
+            if chunk_id == b"COMM":
+                self.channels, _, bits = struct.unpack_from(">hIh", header, offset)
+                self.samplerate = int(_extended_to_float(header[offset + 8:offset + 18]))
+                compression = header[offset + 18:offset + 22] if compressed else b"NONE"
+                if compression not in _AIFC_COMPRESSION:
+                    raise PCMFormatError(f"compressed AIFF data ({compression!r}) in {self.name}")
+                comm = _AIFC_COMPRESSION[compression] + (bits,)
+            elif chunk_id == b"SSND" and comm is not None:
+                data_offset = struct.unpack_from(">I", header, offset)[0]
+                return (offset + 8 + data_offset, size - 8 - data_offset) + comm
+        raise PCMFormatError(f"no COMM and SSND chunks in {self.name}")
+
+    def __len__(self):
+        return self.frames
+
+    def channel(self, index, start, stop):
+        """ raw samples of a channel between start and stop: a strided view into the mapped file,
+        except for 24 bit audio which is assembled into int32. See to_float. """
+        if self.sample_bytes != 3:
+            return self._channels[start:stop, index]
+
+        sample_bytes = self._channels[start:stop, index].astype(numpy.int32)
+        high, low = (0, 2) if self._byte_order == ">" else (2, 0)
+        # shifting the high byte all the way up and back down again extends its sign
+        return ((sample_bytes[:, high] << 24) | (sample_bytes[:, 1] << 16) | (sample_bytes[:, low] << 8)) >> 8
+
+    def left_channel(self, start, stop):
+        return self.channel(0, start, stop)
+
+    def to_float(self, samples):
+        """ convert raw samples to float32 between -1 and 1, the same way libsndfile does """
+        if self._scale is None:
+            return samples.astype(numpy.float32, copy=False)
+        if self._offset:
+            samples = samples.astype(numpy.int16) - self._offset
+        return samples.astype(numpy.float32) * self._scale
+
+    def read_left(self, start, frames):
+        """ frames float32 samples of the left channel starting at start """
+        return self.to_float(self.left_channel(start, start + frames))
+
+    def seek(self, frames):
+        self.position = frames
+
+    def read(self, frames, dtype="float32"):
+        """ read like soundfile.SoundFile.read does, all channels """
+        stop = min(self.position + frames, self.frames)
+        samples = numpy.stack([self.to_float(self.channel(index, self.position, stop))
+                               for index in range(self.channels)], axis=-1)
+        self.position = stop
+        if self.channels == 1:
+            samples = samples[:, 0]
+        return samples.astype(dtype, copy=False)
+
+    def close(self):
+        self._data = None
+        self._channels = None
+
+
+def open_pcm(filename):
+    """ the PCMFile of filename, or None if it can't be memory mapped """
+    try:
+        return PCMFile(filename)
+    except (PCMFormatError, OSError, ValueError, struct.error):
+        return None
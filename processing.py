@@ -23,14 +23,19 @@
 
 
 try:
+    import contextlib
+    import functools
     import math
     import os
+    import queue
     import sys
-    import re
-    import subprocess
+    import threading
     import numpy
     import soundfile as sf
-    from PIL import Image, ImageDraw
+    from PIL import Image
+    from fft_backend import fft_backend
+    from pcm_reader import PCMFile, open_pcm
+    from render_stats import stage
     from color_schemes import COLOR_SCHEMES, DEFAULT_COLOR_SCHEME_KEY
 
 except Exception as e:
@@ -46,6 +51,16 @@ except Exception as e:
 class AudioProcessingException(Exception):
     pass
 
+# number of samples analyze_audio reads and transforms in one block, more is faster but takes more mem
+ANALYSIS_BLOCK_SIZE = 2 ** 20
+# number of columns create_wave_images normalizes and draws in one block
+DRAW_BLOCK_SIZE = 1024
+# number of blocks of samples decoded ahead of the one being analysed, see prefetched
+PREFETCH_DEPTH = 2
+# the band the spectrogram shows and the spectral centroids are scaled to, in Hz
+MIN_FREQUENCY = 100.0
+MAX_FREQUENCY = 22050.0
+
 def get_max_level(filename):
     max_value = 0
     buffer_size = 4096
@@ -65,31 +80,171 @@ def get_max_level(filename):
 
     return max_value
 
+
+def band_factor(samplerate):
+    """ how many times the band of audio at samplerate holds the displayed one (rounded down): 2 for
+    88.2 and 96 kHz, 4 for 176.4 and 192 kHz and 1 below """
+    return max(1, int(samplerate // (2 * MAX_FREQUENCY)))
+
+
+def spectrum_bins(fft_size, samplerate):
+    """ number of FFT bins kept of every frame: the lowest 1 / band_factor of them, the band a 44.1
+    or 48 kHz file has. The bins are samplerate / fft_size apart at every rate """
+    return (fft_size // 2) // band_factor(samplerate) + 1
+
+
+@functools.lru_cache(maxsize=16)
+def analysis_window(window_function, fft_size):
+    """
+    (window, max_fft): window_function(fft_size) and the maximum of abs(FFT) of a DC signal through
+    it, what spectra are normalized by. Read only, computed once per window function and FFT size
+    """
+    window = window_function(fft_size)
+    window.flags.writeable = False
+    max_fft = numpy.abs(numpy.fft.rfft(numpy.ones(fft_size) * window)).max()
+    return window, max_fft
+
+
+@functools.lru_cache(maxsize=16)
+def bin_numbers(n_bins):
+    """ 0.0, 1.0, ... n_bins - 1 (read only), what spectral centroids weigh the bins with """
+    numbers = numpy.arange(numpy.float64(n_bins))
+    numbers.flags.writeable = False
+    return numbers
+
+
+class SequentialReader:
+    """
+    Reads the left channel of a soundfile.SoundFile front to back, decoding every sample once.
+    read hands out float32 views of buffers that are reused in turn (slots of them): the samples a
+    span shares with the one before it are copied over instead of being decoded again, and the
+    padding outside of the file is written in place. A view stays valid until slots more spans have
+    been read, so with prefetched up to PREFETCH_DEPTH + 1 of them may still be in use while the
+    next one is read.
+    """
+
+    # frames decoded at once from files with more than one channel, before the left one is copied out
+    CHUNK_SIZE = 2 ** 16
+
+    def __init__(self, audio_file, slots=1):
+        self.audio_file = audio_file
+        self.nframes = len(audio_file)
+        self.slots = [numpy.empty(0, dtype=numpy.float32) for _ in range(slots)]
+        self.next_slot = 0
+        self.chunk = None
+        # (start, end, samples) of the span read last
+        self.previous = None
+
+    def read(self, start, end):
+        """ the samples start..end (zeros outside of the file), returns (view, number of samples
+        decoded for it). start should not be before the start of the span read last, going back
+        makes the file seek backwards and decode again """
+        length = end - start
+        slot = self.slots[self.next_slot]
+        if len(slot) < length:
+            # only while the spans get longer, they are about the same length from block to block
+            slot = self.slots[self.next_slot] = numpy.empty(length, dtype=numpy.float32)
+        self.next_slot = (self.next_slot + 1) % len(self.slots)
+        samples = slot[:length]
+
+        position = start
+        if self.previous is not None:
+            previous_start, previous_end, previous = self.previous
+            if previous_start <= start < previous_end:
+                position = min(end, previous_end)
+                samples[:position - start] = previous[start - previous_start:position - previous_start]
+
+        if position < 0:
+            samples[:min(0, end) - start] = 0
+            position = min(0, end)
+
+        decoded = 0
+        if position < min(end, self.nframes):
+            if self.audio_file.tell() != position:
+                # only forward when the columns are read in order: the gap between two spans
+                self.audio_file.seek(position)
+            try:
+                decoded = self.decode(samples[position - start:min(end, self.nframes) - start])
+            except RuntimeError:
+                # this can happen for wave files with broken headers...
+                pass
+            position += decoded
+
+        samples[position - start:] = 0
+        self.previous = (start, end, samples)
+        return samples, decoded
+
+    def decode(self, out):
+        """ decode the next len(out) samples of the left channel into out, returns how many there were """
+        if self.audio_file.channels == 1:
+            return len(self.audio_file.read(out=out))
+
+        if self.chunk is None:
+            self.chunk = numpy.empty((self.CHUNK_SIZE, self.audio_file.channels), dtype=numpy.float32)
+        done = 0
+        while done < len(out):
+            frames = len(self.audio_file.read(out=self.chunk[:min(self.CHUNK_SIZE, len(out) - done)]))
+            out[done:done + frames] = self.chunk[:frames, 0]
+            done += frames
+            if frames == 0:
+                break
+        return done
+
+
 class AudioProcessor:
     """
     The audio processor processes chunks of audio an calculates the spectrac centroid and the peak
     samples in that chunk of audio.
     """
 
-    def __init__(self, input_filename, fft_size, window_function=numpy.hanning):
-        max_level = get_max_level(input_filename)
-        self.audio_file = sf.SoundFile(input_filename, 'r')
+    def __init__(self, input_filename, fft_size, window_function=numpy.hanning, normalize=True, audio_file=None):
+        """ if normalize is False the file is not scanned for its maximum level up front, use
+        set_max_level once the level is known (see analyze_audio). audio_file is an already open
+        soundfile.SoundFile to use instead of opening input_filename (see streaming.py) """
+        self.input_filename = input_filename
+        # uncompressed files are memory mapped instead of decoded, see pcm_reader
+        # compared to None, files of 0 frames are false (they have a length)
+        if audio_file is None:
+            audio_file = open_pcm(input_filename)
+        if audio_file is None:
+            audio_file = sf.SoundFile(input_filename, 'r')
+        self.audio_file = audio_file
+        self.mapped = isinstance(self.audio_file, PCMFile)
+        # bytes decoded (or mapped) per frame read, all channels
+        self.frame_bytes = self.audio_file.channels * (self.audio_file.sample_bytes if self.mapped else 4)
+        # decodes the spans of consecutive columns, see read_span
+        self.reader = None
         self.nframes = len(self.audio_file)
         self.samplerate = self.audio_file.samplerate
         self.fft_size = fft_size
-        self.window = window_function(self.fft_size)
+        self.window_function = window_function
+        self.window, self.max_fft = analysis_window(window_function, fft_size)
+        # the FFT of the frames, see fft_backend.py
+        self.fft = fft_backend()
+        # of high rate audio, the bins above the displayed band are dropped right after the FFT
+        # instead of being normalized, converted and kept. The audio isn't decimated, the FFT still
+        # transforms fft_size samples per column at any rate
+        self.n_bins = spectrum_bins(fft_size, self.samplerate)
         self.spectrum_range = None
-        self.lower = 100
-        self.higher = 22050
+        self.lower = MIN_FREQUENCY
+        self.higher = MAX_FREQUENCY
         self.lower_log = math.log10(self.lower)
         self.higher_log = math.log10(self.higher)
-        self.clip = lambda val, low, high: min(high, max(low, val))
 
-        # figure out what the maximum value is for an FFT doing the FFT of a DC signal
-        fft = numpy.fft.rfft(numpy.ones(fft_size) * self.window)
-        max_fft = (numpy.abs(fft)).max()
-        # set the scale to normalized audio and normalized FFT
-        self.scale = (1.0 / max_level) / max_fft if max_level > 0 else 1
+        # the frames are windowed into this buffer, grown as needed (and handed on by Renderer)
+        self.frame_buffer = None
+        self.max_level = 0
+        self.scale = 1
+        # a render_stats.RenderStats to measure the stages of the analysis into, if any
+        self.stats = None
+
+        if normalize:
+            self.set_max_level(get_max_level(input_filename))
+
+    def set_max_level(self, max_level):
+        """ set the scale to normalized audio and normalized FFT """
+        self.max_level = max_level
+        self.scale = (1.0 / max_level) / self.max_fft if max_level > 0 else 1
 
     def read(self, start, size, resize_if_less=False):
         """ read size samples starting at start, if resize_if_less is True and less than size
@@ -102,9 +257,9 @@ class AudioProcessor:
         if start < 0:
             # the first FFT window starts centered around zero
             if size + start <= 0:
-                return numpy.zeros(size) if resize_if_less else numpy.array([])
+                return numpy.zeros(size, dtype=numpy.float32) if resize_if_less else numpy.array([])
             else:
-                self.audio_file.seek(0)
+                read_start = 0
 
                 add_to_start = -start  # remember: start is negative!
                 to_read = size + start
@@ -113,79 +268,199 @@ class AudioProcessor:
                     add_to_end = to_read - self.nframes
                     to_read = self.nframes
         else:
-            self.audio_file.seek(start)
+            read_start = start
 
             to_read = size
             if start + to_read >= self.nframes:
                 to_read = self.nframes - start
                 add_to_end = size - to_read
 
-        try:
-            samples = self.audio_file.read(to_read, dtype='float32')
-        except RuntimeError:
-            # this can happen for wave files with broken headers...
-            return numpy.zeros(size) if resize_if_less else numpy.zeros(2)
-
-        # convert to mono by selecting left channel only
-        if self.audio_file.channels > 1:
-            samples = samples[:, 0]
+        with stage(self.stats, "decode"):
+            if self.mapped:
+                # convert to mono by selecting left channel only
+                samples = self.audio_file.read_left(read_start, to_read)
+            else:
+                self.audio_file.seek(read_start)
+                try:
+                    samples = self.audio_file.read(to_read, dtype='float32')
+                except RuntimeError:
+                    # this can happen for wave files with broken headers...
+                    return numpy.zeros(size if resize_if_less else 2, dtype=numpy.float32)
+
+                # convert to mono by selecting left channel only
+                if self.audio_file.channels > 1:
+                    samples = samples[:, 0]
+        if self.stats:
+            self.stats.count("decode", len(samples), len(samples) * self.frame_bytes)
 
         if resize_if_less and (add_to_start > 0 or add_to_end > 0):
-            if add_to_start > 0:
-                samples = numpy.concatenate((numpy.zeros(add_to_start), samples), axis=0)
+            padded = numpy.zeros(size, dtype=samples.dtype)
+            padded[add_to_start:add_to_start + len(samples)] = samples
+            samples = padded
 
-            if add_to_end > 0:
-                samples = numpy.resize(samples, size)
-                samples[size - add_to_end:] = 0
+        return samples
 
+    def read_span(self, start, end):
+        """ the samples start..end, zero padded like read(start, end - start, True), for spans that
+        come in order (the columns of analyze_range, tiles and sidecars): decoded front to back once
+        into reused buffers, see SequentialReader """
+        if self.reader is None:
+            # as many buffers as spans may be in use at once, see prefetched
+            self.reader = SequentialReader(self.audio_file, PREFETCH_DEPTH + 2)
+
+        with stage(self.stats, "decode"):
+            samples, decoded = self.reader.read(start, end)
+        if self.stats:
+            self.stats.count("decode", decoded, decoded * self.frame_bytes)
         return samples
 
+    def raw_spectrum(self, seek_point):
+        """ starting at seek_point read fft_size samples and return abs(FFT), not yet normalized """
+        return self.raw_spectra([seek_point])[0]
+
+    def raw_spectra(self, seek_points):
+        """ batched version of raw_spectrum: the samples spanning all seek_points are read at once
+        and the analysis frames are cut from them as a strided 2-D view, so windowing and FFT run
+        over all frames in one go. Returns one row of abs(FFT) per seek point. """
+
+        starts = numpy.asarray(seek_points, dtype=numpy.int64) - self.fft_size // 2
+        first = int(starts[0])
+
+        samples = self.read(first, int(starts[-1]) - first + self.fft_size, True)
+        return self.frame_spectra(samples, starts - first)
+
+    def frame_spectra(self, samples, frame_starts, convert=None):
+        """ abs(FFT) of the fft_size long frames of samples starting at the indices frame_starts,
+        if given convert turns the frames into float samples first """
+
+        with stage(self.stats, "fft"):
+            # every fft_size long window of samples, a read only view (sliding_window_view needs numpy 1.20)
+            windows = numpy.lib.stride_tricks.as_strided(samples, (len(samples) - self.fft_size + 1, self.fft_size),
+                                                         samples.strides * 2, writeable=False)
+            frames = windows[frame_starts]
+            if convert is not None:
+                frames = convert(frames)
+
+            # windowed frames are kept in float32, just like the samples they are made of
+            windowed = numpy.multiply(frames, self.window, out=self.windowed_frames(frames.shape))
+            spectra = numpy.abs(self.fft.rfft(windowed)[:, :self.n_bins])
+        if self.stats:
+            self.stats.count("fft", frames.size)
+        return spectra
+
+    def windowed_frames(self, shape):
+        """ a float32 array of shape in frame_buffer, which is only used until the frames are transformed """
+        size = shape[0] * shape[1]
+        if self.frame_buffer is None or len(self.frame_buffer) < size:
+            self.frame_buffer = numpy.empty(size, dtype=numpy.float32)
+        return self.frame_buffer[:size].reshape(shape)
+
+    def column_span(self, seek_points):
+        """ first and end (exclusive) sample of the columns seek_points[i]..seek_points[i + 1] and
+        the FFT frames centered around their starts """
+        first = int(seek_points[0]) - self.fft_size // 2
+        # an empty column still needs the sample at its start, see peaks
+        end = max(int(seek_points[-2]) + self.fft_size // 2, int(seek_points[-1]), int(seek_points[-2]) + 1)
+        return first, end
+
+    def read_columns(self, seek_points):
+        """
+        Read (and decode) the samples analyze_columns needs for the columns seek_points, without
+        analysing them. Returns (samples, raw), raw meaning the samples come straight from the mapped
+        file and are still to be converted with audio_file.to_float.
+        """
+        first, end = self.column_span(seek_points)
+
+        if self.mapped and self.audio_file.exact_float and first >= 0 and end <= self.nframes:
+            with stage(self.stats, "decode"):
+                samples = self.audio_file.left_channel(first, end)
+            if self.stats:
+                self.stats.count("decode", len(samples), len(samples) * self.frame_bytes)
+            return samples, True
+
+        if not self.mapped:
+            return self.read_span(first, end), False
+        return self.read(first, end - first, True), False
+
+    def analyze_columns(self, seek_points, block=None):
+        """ read the samples of the columns seek_points[i]..seek_points[i + 1] (and the FFT frames
+        centered around their starts) once, and return both their peaks (see ordered_peaks) and
+        their raw spectra. block is what read_columns(seek_points) returned, if they were read already """
+
+        seek_points = numpy.asarray(seek_points, dtype=numpy.int64)
+        first, _ = self.column_span(seek_points)
+        samples, raw = self.read_columns(seek_points) if block is None else block
+
+        column_starts = seek_points[:-1] - first
+        frame_starts = column_starts - self.fft_size // 2
+        if self.stats:
+            # the samples of the columns, each scanned once for its peaks
+            n_samples = int(seek_points[-1] - seek_points[0])
+            self.stats.count("peaks", n_samples, n_samples * samples.itemsize)
+
+        if raw:
+            # straight from the mapped file: the peaks are found among the raw samples and only the
+            # samples of the FFT frames are converted, which for wide columns is a small part of them
+            with stage(self.stats, "peaks"):
+                peaks = self.audio_file.to_float(ordered_peaks(samples, seek_points - first))
+            if len(frame_starts) * self.fft_size < len(samples):
+                return peaks, self.frame_spectra(samples, frame_starts, self.audio_file.to_float)
+            with stage(self.stats, "decode"):
+                samples = self.audio_file.to_float(samples)
+            return peaks, self.frame_spectra(samples, frame_starts)
+
+        with stage(self.stats, "peaks"):
+            peaks = ordered_peaks(samples, seek_points - first)
+
+        return peaks, self.frame_spectra(samples, frame_starts)
+
     def spectral_centroid(self, seek_point, spec_range=110.0):
         """ starting at seek_point read fft_size samples, and calculate the spectral centroid """
+        spectral_centroids, db_spectra = self.spectrum_features(self.raw_spectra([seek_point]), spec_range)
+        return spectral_centroids[0], db_spectra[0]
 
-        samples = self.read(seek_point - self.fft_size // 2, self.fft_size, True)
+    def spectrum_features(self, raw_spectra, spec_range=110.0):
+        """ normalize spectra returned by raw_spectra (one per row) and calculate their spectral
+        centroids and db spectra """
 
-        samples *= self.window
-        fft = numpy.fft.rfft(samples)
-        spectrum = self.scale * numpy.abs(fft)  # normalized abs(FFT) between 0 and 1
-        length = numpy.float64(spectrum.shape[0])
+        spectra = self.scale * raw_spectra  # normalized abs(FFT) between 0 and 1
+        return self.spectral_centroids(spectra), self.db_spectra(spectra, spec_range)
 
-        # scale the db spectrum from [- spec_range db ... 0 db] > [0..1]
-        db_spectrum = ((20 * (numpy.log10(spectrum + 1e-60))).clip(-spec_range, 0.0) + spec_range)
-        db_spectrum = db_spectrum / spec_range
+    def db_spectra(self, spectra, spec_range=110.0):
+        """ normalized spectra in db, scaled from [- spec_range db ... 0 db] > [0..1] """
+        # the smallest normal value of their type as the floor, 1e-60 is 0 in float32
+        db_spectra = ((20 * (numpy.log10(spectra + numpy.finfo(spectra.dtype).tiny))).clip(-spec_range, 0.0) +
+                      spec_range)
+        return db_spectra / spec_range
 
-        energy = spectrum.sum()
-        spectral_centroid = 0
+    def spectral_centroids(self, spectra):
+        """ spectral centroids of normalized spectra (one per row), log scaled between 0 and 1 """
 
-        if energy > 1e-60:
-            # calculate the spectral centroid
+        # bins are samplerate / fft_size apart, also when there are less than fft_size // 2 + 1 of them
+        half_fft = numpy.float64(self.fft_size // 2)
 
-            if self.spectrum_range is None:
-                self.spectrum_range = numpy.arange(length)
+        if self.spectrum_range is None:
+            self.spectrum_range = bin_numbers(spectra.shape[-1])
 
-            spectral_centroid = ((spectrum * self.spectrum_range).sum() / (
-                        energy * (length - 1))) * self.samplerate * 0.5
+        energy = spectra.sum(axis=-1)
+        has_energy = energy > 1e-60
 
-            # clip > log10 > scale between 0 and 1
-            spectral_centroid = (math.log10(self.clip(spectral_centroid, self.lower, self.higher)) - self.lower_log) / (
-                        self.higher_log - self.lower_log)
+        # calculate the spectral centroid where there is any energy, 0 elsewhere
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            spectral_centroids = ((spectra * self.spectrum_range).sum(axis=-1) / (
+                        energy * half_fft)) * self.samplerate * 0.5
 
-        return spectral_centroid, db_spectrum
+        # clip > log10 > scale between 0 and 1
+        spectral_centroids = (numpy.log10(spectral_centroids.clip(self.lower, self.higher)) - self.lower_log) / (
+                    self.higher_log - self.lower_log)
+
+        return numpy.where(has_energy, spectral_centroids, 0)
 
     def peaks(self, start_seek, end_seek):
         """ read all samples between start_seek and end_seek, then find the minimum and maximum peak
         in that range. Returns that pair in the order they were found. So if min was found first,
         it returns (min, max) else the other way around. """
 
-        # larger blocksizes are faster but take more mem...
-        # Aha, Watson, a clue, a tradeoff!
-        block_size = 4096
-
-        max_index = -1
-        max_value = -1
-        min_index = -1
-        min_value = 1
-
         if start_seek < 0:
             start_seek = 0
 
@@ -196,27 +471,197 @@ class AudioProcessor:
             samples = self.read(start_seek, 1)
             return samples[0], samples[0]
 
-        if block_size > end_seek - start_seek:
-            block_size = end_seek - start_seek
+        samples = self.read(start_seek, end_seek - start_seek)
+        first, second = ordered_peaks(samples, [0, len(samples)])[0]
+        return first, second
+
+
+def ordered_peaks(samples, boundaries):
+    """
+    Find the minimum and maximum of every column of samples at once, column i being
+    samples[boundaries[i]:boundaries[i + 1]]. Like AudioProcessor.peaks every pair is returned
+    in the order it was found, (min, max) if the min comes first, (max, min) otherwise. An empty
+    column gets its first sample twice.
+    Returns an array of shape (len(boundaries) - 1, 2).
+    """
+    boundaries = numpy.asarray(boundaries, dtype=numpy.int64)
+    starts = boundaries[:-1]
+    offset = int(boundaries[0])
+    end = int(boundaries[-1])
+
+    # an empty last column still needs its first sample
+    samples = samples[:max(end, int(starts[-1]) + 1)]
+    mins = numpy.minimum.reduceat(samples, starts)
+    maxs = numpy.maximum.reduceat(samples, starts)
+
+    # position of the first min and max of every column: mark the samples equal to the extreme of
+    # their column and take the smallest marked position per column (one past the end if there is
+    # none, which only happens for empty columns)
+    lengths = numpy.diff(boundaries)
+    span = samples[offset:end]
+    positions = numpy.arange(offset, end + 1)
+    first_min = numpy.minimum.reduceat(
+        numpy.where(numpy.append(span == numpy.repeat(mins, lengths), False), positions, end + 1),
+        starts - offset)
+    first_max = numpy.minimum.reduceat(
+        numpy.where(numpy.append(span == numpy.repeat(maxs, lengths), False), positions, end + 1),
+        starts - offset)
+
+    min_first = first_min < first_max
+    return numpy.stack((numpy.where(min_first, mins, maxs), numpy.where(min_first, maxs, mins)), axis=-1)
+
+
+def merge_peaks(peaks, boundaries):
+    """
+    Merge ordered peak pairs (as returned by ordered_peaks) of the columns
+    boundaries[i]..boundaries[i + 1] into one ordered pair per merged column. Merged columns must
+    not be empty.
+    """
+    # the pairs are in the order they were found, so flattened they are in order as well
+    return ordered_peaks(numpy.asarray(peaks).reshape(-1), 2 * numpy.asarray(boundaries, dtype=numpy.int64))
 
-        for i in range(start_seek, end_seek, block_size):
-            samples = self.read(i, block_size)
 
-            local_max_index = numpy.argmax(samples)
-            local_max_value = samples[local_max_index]
+def analyze_audio(processor, image_width, progress_callback=None, workers=1):
+    """
+    Read the audio once, collecting the peaks and the raw (not yet normalized) spectrum of every
+    column of an image_width wide image. Columns are analysed a block at a time (see
+    AudioProcessor.analyze_columns). The maximum level is tracked along the way and handed to
+    processor.set_max_level afterwards, so spectra can be normalized without decoding the file a
+    second time (as get_max_level would).
+    With workers > 1 the columns are split into that many contiguous segments, each analysed by a
+    process of its own (see analyze_segment). The result is the same as with a single worker.
+    Returns (peaks, raw_spectra), one entry per column.
+    """
+    samples_per_pixel = processor.nframes / float(image_width)
+    seek_points = (numpy.arange(image_width + 1) * samples_per_pixel).astype(numpy.int64)
+
+    progress_step = max(1, image_width // 100)
+    next_progress = 0
 
-            if local_max_value > max_value:
-                max_value = local_max_value
-                max_index = local_max_index
+    def report_progress(position):
+        nonlocal next_progress
+        while progress_callback and next_progress < position:
+            progress_callback(next_progress, image_width)
+            next_progress += progress_step
 
-            local_min_index = numpy.argmin(samples)
-            local_min_value = samples[local_min_index]
+    workers = min(workers, image_width)
+    if workers > 1:
+        segment_bounds = [image_width * i // workers for i in range(workers + 1)]
+        segments = []
+        done = 0
 
-            if local_min_value < min_value:
-                min_value = local_min_value
-                min_index = local_min_index
+        # imported here, it takes longer than the rest of the imports of a single process render
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with stage(processor.stats, "analyze"), ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(analyze_segment, processor.input_filename, processor.fft_size,
+                                       processor.window_function, seek_points[x0:x1 + 1])
+                       for x0, x1 in zip(segment_bounds[:-1], segment_bounds[1:])]
+            for future in as_completed(futures):
+                done += len(future.result()[0])
+                report_progress(done)
 
-        return (min_value, max_value) if min_index < max_index else (max_value, min_value)
+            segments = [future.result() for future in futures]
+
+        all_peaks = numpy.concatenate([peaks for peaks, _ in segments])
+        raw_spectra = numpy.concatenate([spectra for _, spectra in segments])
+    else:
+        all_peaks, raw_spectra = analyze_range(processor, seek_points, report_progress)
+
+    # the peak pairs cover every sample of the file, so their extremes are the maximum level
+    processor.set_max_level(max(0, numpy.abs(all_peaks).max()))
+
+    return all_peaks, raw_spectra
+
+
+def analyze_range(processor, seek_points, progress_callback=None):
+    """
+    Peaks and raw spectra of the columns seek_points[i]..seek_points[i + 1], a block of columns
+    at a time. progress_callback is called with the number of columns done before every block.
+    """
+    n_columns = len(seek_points) - 1
+    samples_per_pixel = (seek_points[-1] - seek_points[0]) / float(n_columns)
+
+    # keep the block of samples (and FFT frames) read at once to about ANALYSIS_BLOCK_SIZE samples
+    columns_per_block = max(1, int(ANALYSIS_BLOCK_SIZE // max(samples_per_pixel, processor.fft_size)))
+
+    all_peaks = None
+    raw_spectra = None
+
+    def read_blocks():
+        for x0 in range(0, n_columns, columns_per_block):
+            x1 = min(x0 + columns_per_block, n_columns)
+            yield x0, x1, processor.read_columns(seek_points[x0:x1 + 1])
+
+    # the next blocks are decoded while this one is analysed, mapped files aren't decoded
+    blocks = read_blocks() if processor.mapped else prefetched(read_blocks())
+    with contextlib.closing(blocks):
+        for x0, x1, block in blocks:
+            if progress_callback:
+                progress_callback(x1)
+
+            block_peaks, block_spectra = processor.analyze_columns(seek_points[x0:x1 + 1], block)
+            if raw_spectra is None:
+                all_peaks = numpy.empty((n_columns, 2), dtype=block_peaks.dtype)
+                raw_spectra = numpy.empty((n_columns, block_spectra.shape[1]), dtype=block_spectra.dtype)
+            all_peaks[x0:x1] = block_peaks
+            raw_spectra[x0:x1] = block_spectra
+
+    return all_peaks, raw_spectra
+
+
+def prefetched(items, depth=PREFETCH_DEPTH):
+    """
+    Iterate over items, producing them on a thread of its own up to depth items ahead, so reading
+    the next blocks of samples (soundfile decodes without holding the GIL) overlaps with analysing
+    this one. Errors producing an item are raised where it would have been returned.
+    """
+    pending = queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # the consumer may stop early, never wait for it forever
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((None, e))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = pending.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def analyze_segment(input_filename, fft_size, window_function, seek_points):
+    """ worker side of analyze_audio with workers > 1: analyse a segment of the columns with an
+    AudioProcessor (and so a sound file) of its own """
+    processor = AudioProcessor(input_filename, fft_size, window_function, normalize=False)
+    try:
+        return analyze_range(processor, seek_points)
+    finally:
+        processor.audio_file.close()
 
 
 def interpolate_colors(colors, flat=False, num_colors=256):
@@ -249,6 +694,34 @@ def interpolate_colors(colors, flat=False, num_colors=256):
     return palette
 
 
+@functools.lru_cache(maxsize=64)
+def palette_lut(colors):
+    """
+    interpolate_colors(colors) as a read only (256, 3) uint8 array, computed once per list of colors
+    (colors being a tuple of (r,g,b) tuples, so it can be the key)
+    """
+    # the same arithmetic as interpolate_colors, on all colors at once
+    index = numpy.arange(256) * (len(colors) - 1) / 255.0
+    index_int = index.astype(numpy.intp)
+    alpha = (index - index_int)[:, numpy.newaxis]
+    table = numpy.array(colors, dtype=numpy.float64)
+    lut = ((1.0 - alpha) * table[index_int] + alpha * table[numpy.minimum(index_int + 1, len(colors) - 1)])
+    lut = lut.astype(numpy.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def scheme_palette(colors):
+    return palette_lut(tuple(tuple(color) for color in colors))
+
+
+def fill_pixels(pixels, color):
+    """ set every pixel of pixels (rows, columns, channels) to color. The first row is filled and
+    copied to the others, which is many times faster than broadcasting color over all of them """
+    pixels[0] = color
+    pixels[1:] = pixels[0]
+
+
 class WaveformImage:
     """
     Given peaks and spectral centroids from the AudioProcessor, this class will construct
@@ -257,90 +730,158 @@ class WaveformImage:
 
     def __init__(self, image_width, image_height, color_scheme):
         if image_height % 2 == 0:
-            print("WARNING: Height is not uneven, images look much better at uneven height")
+            # on stderr, stdout may be the JSON lines of wav2png.py --progress-format json
+            print("WARNING: Height is not uneven, images look much better at uneven height", file=sys.stderr)
 
         if isinstance(color_scheme, dict):
             self.color_scheme_to_use = color_scheme
         else:
             self.color_scheme_to_use = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES[DEFAULT_COLOR_SCHEME_KEY])
-        
+
         self.transparent_background = self.color_scheme_to_use.get('wave_transparent_background', False)
-        if self.transparent_background:
-            self.image = Image.new("RGBA", (image_width, image_height), (0, 0, 0, 0))
-        else:
-            background_color = self.color_scheme_to_use['wave_colors'][0]  # Only used if transparent_background is False
-            self.image = Image.new("RGB", (image_width, image_height),  background_color)
+        self.pixels = numpy.empty((image_height, image_width, 4 if self.transparent_background else 3),
+                                  dtype=numpy.uint8)
 
         self.image_width = image_width
         self.image_height = image_height
 
-        self.draw = ImageDraw.Draw(self.image)
-        self.previous_x, self.previous_y = None, None
-
         colors = self.color_scheme_to_use['wave_colors'][1:]
-        self.color_lookup = interpolate_colors(colors)
-        self.pix = self.image.load()
+        self.color_lookup = scheme_palette(colors)
+
+        self.clear()
+
+    def clear(self):
+        """ back to the empty image, to draw another one into the same pixels (see Renderer) """
+        if self.transparent_background:
+            self.pixels[:] = 0
+        else:
+            fill_pixels(self.pixels, self.color_scheme_to_use['wave_colors'][0])
+        self.previous_x, self.previous_y = None, None
 
     def draw_peaks(self, x, peaks, spectral_centroid):
         """ draw 2 peaks at x using the spectral_centroid for color """
+        self.draw_columns(x, [peaks], [spectral_centroid])
 
-        y1 = self.image_height * 0.5 - peaks[0] * (self.image_height - 4) * 0.5
-        y2 = self.image_height * 0.5 - peaks[1] * (self.image_height - 4) * 0.5
+    def draw_columns(self, x, peaks, spectral_centroids):
+        """ draw the columns x, x + 1, ... from their peaks and spectral centroids. Every column is
+        a vertical line between its 2 peaks, joined to the last peak of the column before it like a
+        1 pixel wide polyline would be. Columns are expected to be drawn left to right. """
 
-        line_color = self.color_lookup[int(spectral_centroid * 255.0)]
+        peaks = numpy.asarray(peaks)
+        columns = numpy.arange(x, x + len(peaks))
 
-        if self.previous_y is not None:
-            self.draw.line([self.previous_x, self.previous_y, x, y1, x, y2], line_color)
+        y1 = self.image_height * 0.5 - peaks[:, 0] * (self.image_height - 4) * 0.5
+        y2 = self.image_height * 0.5 - peaks[:, 1] * (self.image_height - 4) * 0.5
+
+        line_colors = self.color_lookup[(numpy.asarray(spectral_centroids) * 255.0).astype(numpy.intp)]
+        if self.transparent_background:
+            line_colors = numpy.concatenate((line_colors, numpy.full((len(peaks), 1), 255, dtype=numpy.uint8)), axis=1)
+
+        # pixel rows, truncated like the line drawing of PIL does
+        y1_int = y1.astype(numpy.int64)
+        y2_int = y2.astype(numpy.int64)
+
+        # the join from the last peak of the previous column to y1 is split between the columns,
+        # the first max(1, (dy + 1) // 2) of its pixels going to the previous column
+        previous_int = numpy.empty_like(y1_int)
+        previous_int[1:] = y2_int[:-1]
+        has_previous = numpy.ones(len(peaks), dtype=bool)
+        if self.previous_y is not None and self.previous_x == x - 1:
+            previous_int[0] = int(self.previous_y)
         else:
-            self.draw.line([x, y1, x, y2], line_color)
+            previous_int[0] = y1_int[0]
+            has_previous[0] = False
+
+        join_direction = numpy.sign(y1_int - previous_int)
+        join_split = numpy.maximum(1, (numpy.abs(y1_int - previous_int) + 1) // 2)
+        join_end = previous_int + join_direction * (join_split - 1)  # last pixel in the previous column
+        join_start = numpy.where(has_previous, join_end + join_direction, y1_int)  # first pixel in this column
+
+        self.fill_columns(columns,
+                          numpy.minimum(numpy.minimum(y1_int, y2_int), join_start),
+                          numpy.maximum(numpy.maximum(y1_int, y2_int), join_start),
+                          line_colors)
+
+        self.draw_anti_aliased_pixels(columns, y1, y2, line_colors)
+
+        # the part of the join in the previous column is drawn over it in the color of this column
+        self.fill_columns(columns[has_previous] - 1,
+                          numpy.minimum(previous_int, join_end)[has_previous],
+                          numpy.maximum(previous_int, join_end)[has_previous],
+                          line_colors[has_previous])
+
+        self.previous_x, self.previous_y = columns[-1], y2[-1]
 
-        self.previous_x, self.previous_y = x, y2
+    def fill_columns(self, columns, y_low, y_high, colors):
+        """ fill the pixels y_low..y_high (inclusive) of the given columns with their color """
 
-        self.draw_anti_aliased_pixels(x, y1, y2, line_color)
+        rows = numpy.arange(self.image_height)[:, numpy.newaxis]
+        inside = ((rows >= y_low) & (rows <= y_high))[..., numpy.newaxis]
+        self.pixels[:, columns] = numpy.where(inside, colors, self.pixels[:, columns])
 
-    def draw_anti_aliased_pixels(self, x, y1, y2, color):
+    def draw_anti_aliased_pixels(self, columns, y1, y2, colors):
         """ vertical anti-aliasing at y1 and y2 """
-        
-        y_max = max(y1, y2)
-        y_max_int = int(y_max)
-        alpha = y_max - y_max_int
-
-        if 0.0 < alpha < 1.0 and y_max_int + 1 < self.image_height:
-            if not self.transparent_background:
-                current_pix = self.pix[x, y_max_int + 1]
-                r = int((1 - alpha) * current_pix[0] + alpha * color[0])
-                g = int((1 - alpha) * current_pix[1] + alpha * color[1])
-                b = int((1 - alpha) * current_pix[2] + alpha * color[2])
-                self.pix[x, y_max_int + 1] = (r, g, b)
-            else:
-                # If using transparent background, don't do anti-aliasing
-                self.pix[x, y_max_int + 1] = (color[0], color[1], color[2], 255)
-                
-
-        y_min = min(y1, y2)
-        y_min_int = int(y_min)
-        alpha = 1.0 - (y_min - y_min_int)
-
-        if 0.0 < alpha < 1.0 and y_min_int - 1 >= 0:
-            if not self.transparent_background:
-                current_pix = self.pix[x, y_max_int + 1]
-                r = int((1 - alpha) * current_pix[0] + alpha * color[0])
-                g = int((1 - alpha) * current_pix[1] + alpha * color[1])
-                b = int((1 - alpha) * current_pix[2] + alpha * color[2])
-                self.pix[x, y_min_int - 1] = (r, g, b)
-            else:
-                # If using transparent background, don't do anti-aliasing
-                self.pix[x, y_max_int + 1] = (color[0], color[1], color[2], 255)
+
+        y_max = numpy.maximum(y1, y2)
+        alpha = y_max - numpy.trunc(y_max)
+        self.blend_pixels(columns, y_max.astype(numpy.int64) + 1, alpha, colors)
+
+        y_min = numpy.minimum(y1, y2)
+        alpha = 1.0 - (y_min - numpy.trunc(y_min))
+        self.blend_pixels(columns, y_min.astype(numpy.int64) - 1, alpha, colors)
+
+    def blend_pixels(self, columns, rows, alpha, colors):
+        """ blend colors into the pixels at (columns, rows) with the given alpha """
+
+        blend = (0.0 < alpha) & (alpha < 1.0) & (rows >= 0) & (rows < self.image_height)
+        columns, rows, alpha, colors = columns[blend], rows[blend], alpha[blend, numpy.newaxis], colors[blend]
+
+        if not self.transparent_background:
+            current_pixels = self.pixels[rows, columns]
+            self.pixels[rows, columns] = ((1 - alpha) * current_pixels + alpha * colors).astype(numpy.uint8)
+        else:
+            # If using transparent background, don't do anti-aliasing
+            self.pixels[rows, columns] = colors
 
     def save(self, filename):
         # draw a zero "zero" line
         a = self.color_scheme_to_use.get('wave_zero_line_alpha', 0)
         if a:
-            for x in range(self.image_width):
-                center = self.image_height // 2
-                self.pix[x, center] = tuple([p + a for p in self.pix[x, center]])
+            center = self.image_height // 2
+            self.pixels[center] = numpy.minimum(self.pixels[center].astype(numpy.int64) + a, 255)
+
+        Image.fromarray(self.pixels).save(filename)
+
+
+@functools.lru_cache(maxsize=16)
+def spectrogram_rows(image_height, fft_size, samplerate):
+    """
+    The lookup which translates y-coordinate to fft-bin for a spectrogram image_height high:
+    (bin_indices, bin_alphas), read only, each y between the bins bin_indices[y] and
+    bin_indices[y] + 1, bin_alphas[y] (0..255) being the weight of the latter. Only the rows
+    below the last bin are there
+    """
+    bin_indices = []
+    bin_alphas = []
+    y_min = math.log10(MIN_FREQUENCY)
+    y_max = math.log10(MAX_FREQUENCY)
+    nyquist = samplerate / 2.0
+    n_bins = spectrum_bins(fft_size, samplerate)
+    for y in range(image_height):
+        freq = math.pow(10.0, y_min + y / (image_height - 1.0) * (y_max - y_min))
+        bin = freq / nyquist * (fft_size // 2 + 1)
+
+        if bin < n_bins - 1:
+            alpha = bin - int(bin)
+
+            bin_indices.append(int(bin))
+            bin_alphas.append(alpha * 255)
 
-        self.image.save(filename)
+    bin_indices = numpy.array(bin_indices, dtype=numpy.intp)
+    bin_alphas = numpy.array(bin_alphas, dtype=numpy.float64)
+    bin_indices.flags.writeable = False
+    bin_alphas.flags.writeable = False
+    return bin_indices, bin_alphas
 
 
 class SpectrogramImage:
@@ -349,91 +890,263 @@ class SpectrogramImage:
     can be saved as PNG.
     """
 
-    def __init__(self, image_width, image_height, fft_size, color_scheme):
+    def __init__(self, image_width, image_height, fft_size, color_scheme, samplerate=44100):
+        """ samplerate is the one of the analysed audio, see spectrum_bins """
         self.image_width = image_width
         self.image_height = image_height
         self.fft_size = fft_size
+        self.samplerate = samplerate
 
-        self.image = Image.new("RGB", (image_height, image_width))
         if isinstance(color_scheme, dict):
             spectrogram_colors = color_scheme['spec_colors']
         else:
             spectrogram_colors = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES[DEFAULT_COLOR_SCHEME_KEY])['spec_colors']
-        self.palette = interpolate_colors(spectrogram_colors)
+        self.palette = scheme_palette(spectrogram_colors)
 
-        # generate the lookup which translates y-coordinate to fft-bin
-        self.y_to_bin = []
-        f_min = 100.0
-        f_max = 22050.0
-        y_min = math.log10(f_min)
-        y_max = math.log10(f_max)
-        for y in range(self.image_height):
-            freq = math.pow(10.0, y_min + y / (image_height - 1.0) * (y_max - y_min))
-            bin = freq / 22050.0 * (self.fft_size // 2 + 1)
+        self.f_min = MIN_FREQUENCY
+        self.f_max = MAX_FREQUENCY
+        self.bin_indices, self.bin_alphas = spectrogram_rows(image_height, fft_size, samplerate)
 
-            if bin < self.fft_size // 2:
-                alpha = bin - int(bin)
+        # the image is filled in column blocks, already rotated: low frequencies at the bottom.
+        # if the FFT is too small to fill up the image, or the audio doesn't reach up to f_max, the
+        # top stays filled with palette[0]
+        self.pixels = numpy.empty((image_height, image_width, 3), dtype=numpy.uint8)
+        self.clear()
 
-                self.y_to_bin.append((int(bin), alpha * 255))
-
-        # this is a bit strange, but using image.load()[x,y] = ... is
-        # a lot slower than using image.putadata and then rotating the image
-        # so we store all the pixels in an array and then create the image when saving
-        self.pixels = []
+    def clear(self):
+        """ back to the empty image, to draw another one into the same pixels (see Renderer) """
+        fill_pixels(self.pixels, self.palette[0])
 
     def draw_spectrum(self, x, spectrum):
-        # for all frequencies, draw the pixels
-        for (index, alpha) in self.y_to_bin:
-            self.pixels.append(self.palette[int((255.0 - alpha) * spectrum[index] + alpha * spectrum[index + 1])])
+        self.draw_spectra(x, numpy.asarray(spectrum)[numpy.newaxis])
+
+    def draw_spectra(self, x, spectra):
+        """ draw the columns x, x + 1, ... from spectra, one spectrum per row """
+        self.draw_values(x, self.spectrum_values(spectra))
+
+    def spectrum_values(self, spectra):
+        """ the interpolated db values (0..255) of the pixel rows of spectra, bottom row first """
+        return (255.0 - self.bin_alphas) * spectra[:, self.bin_indices] + self.bin_alphas * spectra[:, self.bin_indices + 1]
+
+    def draw_values(self, x, values):
+        """ draw the columns x, x + 1, ... from their spectrum_values """
 
-        # if the FFT is too small to fill up the image, fill with black to the top
-        for y in range(len(self.y_to_bin), self.image_height):
-            self.pixels.append(self.palette[0])
+        # for all frequencies, look up the colors of the interpolated db values
+        colors = self.palette[values.astype(numpy.intp)]
+
+        n_bins = len(self.bin_indices)
+        self.pixels[self.image_height - n_bins:, x:x + len(values)] = colors[:, ::-1].transpose(1, 0, 2)
 
     def save(self, filename, quality=80):
-        self.image.putdata(self.pixels)
-        self.image.transpose(Image.ROTATE_90).save(filename, quality=quality)
+        Image.fromarray(self.pixels).save(filename, quality=quality)
 
 
 def create_wave_images(input_filename, output_filename_w, output_filename_s, image_width, image_height, fft_size,
-                       progress_callback=None, color_scheme=None, use_transparent_background=False):
+                       progress_callback=None, color_scheme=None, use_transparent_background=False, workers=1,
+                       sidecar_filename=None, stats=None, encoder=None, export_filename=None, export_format="binary",
+                       export_rows=None):
     """
     Utility function for creating both wavefile and spectrum images from an audio input file.
     :param input_filename: input audio filename (must be PCM)
     :param output_filename_w: output filename for waveform image (must end in .png)
-    :param output_filename_s: output filename for spectrogram image (must end in .jpg)
+    :param output_filename_s: output filename for spectrogram image (must end in .jpg), None for no spectrogram
     :param image_width: width of both spectrogram and waveform images
     :param image_height: height of both spectrogram and waveform images
     :param fft_size: size of the FFT computed for the spectrogram image
     :param progress_callback: function to iteratively call while images are being created. Will be called every 1%,
                                 with parameters (current_position, width)
     :param color_scheme: color scheme to use for the generated images (defaults to Freesound2 color scheme)
+    :param workers: number of processes to split the analysis of the file across (see analyze_audio)
+    :param sidecar_filename: analysis sidecar file of the input (see sidecar.py). Without a spectrogram and an
+                                export, the waveform is rendered from it without reading the audio, creating it first if
+                                it is missing or out of date. Otherwise it is neither used nor created
+    :param stats: render_stats.RenderStats to measure the stages of the render into
+    :param encoder: concurrent.futures executor to encode and save the images on, so the next file can be
+                                analysed meanwhile. The future of saving them is returned (None if they are
+                                saved already)
+    :param export_filename: file to write the values the images are drawn from to, in export_format ("binary" or
+                                "json", see export.py). With output_filename_w None, only the export is written
+    :param export_rows: number of spectrogram rows of the export (export.EXPORT_ROWS if None), 0 for none.
+                                With the image height as export_rows, they are the pixels of the spectrogram image
     """
-    processor = AudioProcessor(input_filename, fft_size, numpy.hanning)
-    samples_per_pixel = processor.nframes / float(image_width)
-
-    waveform = WaveformImage(image_width, image_height, color_scheme)
-    spectrogram = SpectrogramImage(image_width, image_height, fft_size, color_scheme)
+    if sidecar_filename and output_filename_s is None and not export_filename:
+        # the sidecar has the columns of waveforms only, spectrograms and exports need the audio analysed anyway
+        from sidecar import load_sidecar
 
-    for x in range(image_width):
-
-        if progress_callback and x % (image_width // 100) == 0:
-            progress_callback(x, image_width)
-
-        seek_point = int(x * samples_per_pixel)
-        next_seek_point = int((x + 1) * samples_per_pixel)
-
-        (spectral_centroid, db_spectrum) = processor.spectral_centroid(seek_point)
-        peaks = processor.peaks(seek_point, next_seek_point)
-
-        waveform.draw_peaks(x, peaks, spectral_centroid)
-        spectrogram.draw_spectrum(x, db_spectrum)
+        sidecar = load_sidecar(input_filename, sidecar_filename, fft_size)
+        try:
+            sidecar.render_waveform(output_filename_w, image_width, image_height, color_scheme)
+        finally:
+            sidecar.close()
+        if progress_callback:
+            progress_callback(image_width, image_width)
+        return
+
+    processor = AudioProcessor(input_filename, fft_size, numpy.hanning, normalize=False)
+    processor.stats = stats
+    all_peaks, raw_spectra = analyze_audio(processor, image_width, progress_callback, workers)
+
+    return draw_images(processor, all_peaks, raw_spectra, output_filename_w, output_filename_s, image_width,
+                       image_height, progress_callback, color_scheme, encoder, export_filename, export_format,
+                       export_rows)
+
+
+def draw_images(processor, all_peaks, raw_spectra, output_filename_w, output_filename_s, image_width, image_height,
+                progress_callback=None, color_scheme=None, encoder=None, export_filename=None, export_format="binary",
+                export_rows=None, images=None):
+    """ draw and save the images of peaks and raw spectra (see analyze_audio) of every column,
+    processor.set_max_level must have been called already. Stages are measured into processor.stats.
+    With an encoder (a concurrent.futures executor) the images are saved on it, and the future of
+    that is returned. With an export_filename the values the images are drawn from are written to
+    it too (see export.py), output_filename_w may then be None to not draw any images. images is a
+    (WaveformImage, SpectrogramImage) pair of the right size to clear and draw into instead of new
+    ones (see Renderer) """
+    stats = processor.stats
+    fft_size = processor.fft_size
+    reused_waveform, reused_spectrogram = images or (None, None)
+    waveform = None
+    if output_filename_w:
+        with stage(stats, "draw_waveform"):
+            if reused_waveform is None:
+                waveform = WaveformImage(image_width, image_height, color_scheme)
+            else:
+                waveform = reused_waveform
+                waveform.clear()
+    spectrogram = None
+    if output_filename_s:
+        with stage(stats, "draw_spectrogram"):
+            if reused_spectrogram is None:
+                spectrogram = SpectrogramImage(image_width, image_height, fft_size, color_scheme, processor.samplerate)
+            else:
+                spectrogram = reused_spectrogram
+                spectrogram.clear()
+
+    export = None
+    if export_filename:
+        from export import AnalysisExport, EXPORT_ROWS
+
+        rows = None
+        if export_rows != 0:
+            export_rows = export_rows or EXPORT_ROWS
+            # the pixel rows of a spectrogram export_rows high, the image itself if it is
+            rows = spectrogram if spectrogram and export_rows == image_height else \
+                SpectrogramImage(1, export_rows, fft_size, color_scheme, processor.samplerate)
+        export = AnalysisExport(processor, all_peaks, rows)
+
+    for x0 in range(0, image_width, DRAW_BLOCK_SIZE):
+        with stage(stats, "features"):
+            (spectral_centroids, db_spectra) = processor.spectrum_features(raw_spectra[x0:x0 + DRAW_BLOCK_SIZE])
+
+        if waveform:
+            with stage(stats, "draw_waveform"):
+                waveform.draw_columns(x0, all_peaks[x0:x0 + DRAW_BLOCK_SIZE], spectral_centroids)
+        values = None
+        if spectrogram:
+            with stage(stats, "draw_spectrogram"):
+                values = spectrogram.spectrum_values(db_spectra)
+                spectrogram.draw_values(x0, values)
+        if export:
+            with stage(stats, "export"):
+                if export.spectrogram is not None and export.spectrogram is not spectrogram:
+                    values = export.spectrogram.spectrum_values(db_spectra)
+                export.add_columns(x0, spectral_centroids, values)
 
     if progress_callback:
         progress_callback(image_width, image_width)
 
-    waveform.save(output_filename_w)
-    spectrogram.save(output_filename_s)
+    if export:
+        with stage(stats, "export"):
+            export.save(export_filename, export_format)
+        if stats:
+            stats.output("export", export_filename, os.path.getsize(export_filename))
+
+    if waveform is None:
+        return None
+    if encoder is not None:
+        return encoder.submit(save_images, waveform, output_filename_w, spectrogram, output_filename_s, stats)
+    save_images(waveform, output_filename_w, spectrogram, output_filename_s, stats)
+
+
+def save_images(waveform, output_filename_w, spectrogram=None, output_filename_s=None, stats=None):
+    """ encode and save the images, both at once: the waveform on a thread of its own while the
+    spectrogram is encoded on this one (PIL's encoders don't hold the GIL) """
+    def save_waveform():
+        with stage(stats, "encode_waveform"):
+            waveform.save(output_filename_w)
+
+    if spectrogram is None:
+        save_waveform()
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            saved = executor.submit(save_waveform)
+            with stage(stats, "encode_spectrogram"):
+                spectrogram.save(output_filename_s)
+            saved.result()
+
+    if stats:
+        stats.output("encode_waveform", output_filename_w, os.path.getsize(output_filename_w))
+        if spectrogram:
+            stats.output("encode_spectrogram", output_filename_s, os.path.getsize(output_filename_s))
+
+
+class Renderer:
+    """
+    Renders the images of many files at one size, FFT size and color scheme, setting up what only
+    depends on those once instead of per file like create_wave_images does: the images are cleared
+    and drawn into again (a spectrogram per samplerate, their rows to bins tables differ), and the
+    FFT frames of every file are windowed in the same buffer. The window, the palettes and the
+    tables are cached by the functions computing them (analysis_window, palette_lut and
+    spectrogram_rows). For rendering thousands of short sounds in one process:
+
+        renderer = Renderer(500, 171, 2048, "Freesound2")
+        for input_filename in input_filenames:
+            renderer.render(input_filename)
+
+    The images are saved before render returns, a Renderer is not to be used by several threads at once.
+    """
+
+    def __init__(self, image_width, image_height, fft_size=2048, color_scheme=None, window_function=numpy.hanning):
+        self.image_width = image_width
+        self.image_height = image_height
+        self.fft_size = fft_size
+        self.color_scheme = color_scheme
+        self.window_function = window_function
+        self.waveform = WaveformImage(image_width, image_height, color_scheme)
+        self.spectrograms = {}
+        self.frame_buffer = None
+
+    def spectrogram(self, samplerate):
+        """ the SpectrogramImage drawn for files at samplerate """
+        spectrogram = self.spectrograms.get(samplerate)
+        if spectrogram is None:
+            spectrogram = self.spectrograms[samplerate] = SpectrogramImage(
+                self.image_width, self.image_height, self.fft_size, self.color_scheme, samplerate)
+        return spectrogram
+
+    def render(self, input_filename, output_filename_w=None, output_filename_s=None, spectrogram=True,
+               progress_callback=None, stats=None, export_filename=None, export_format="binary", export_rows=None):
+        """
+        Render the images of input_filename like create_wave_images does, named like wav2png.py names
+        them (input_filename + "_w.png" and "_s.jpg") unless other filenames are given, without the
+        spectrogram if spectrogram is False. The export_ parameters are those of create_wave_images
+        """
+        output_filename_w = output_filename_w or input_filename + "_w.png"
+        output_filename_s = (output_filename_s or input_filename + "_s.jpg") if spectrogram else None
+
+        processor = AudioProcessor(input_filename, self.fft_size, self.window_function, normalize=False)
+        processor.stats = stats
+        processor.frame_buffer = self.frame_buffer
+        try:
+            all_peaks, raw_spectra = analyze_audio(processor, self.image_width, progress_callback)
+            images = (self.waveform, self.spectrogram(processor.samplerate) if spectrogram else None)
+            draw_images(processor, all_peaks, raw_spectra, output_filename_w, output_filename_s, self.image_width,
+                        self.image_height, progress_callback, self.color_scheme, None, export_filename,
+                        export_format, export_rows, images)
+        finally:
+            # grown to the largest block of frames so far, the next file starts out with it
+            self.frame_buffer = processor.frame_buffer
+            processor.audio_file.close()
 
 
 class NoSpaceLeftException(Exception):
@@ -0,0 +1,109 @@
+# progress.py
+# Progress callbacks for create_wave_images (and the other render functions), which call them with
+# (columns done, columns): the percentages wav2png.py prints and, for schedulers and other programs
+# watching a render, JSON lines events (wav2png.py --progress-format json):
+#
+#   {"event": "start", "file", "frames", "time"}
+#   {"event": "progress", "file", "stage", "columns_done", "columns", "samples_per_second",
+#    "elapsed", "eta", "time"}
+#   {"event": "done", "file", "frames", "elapsed", "samples_per_second", "error", "time"}
+#   {"event": "cached", "file", "time"}
+#
+# and, from wav2png.py, what it otherwise prints besides the progress of the files:
+#
+#   {"event": "summary", "rendered", "failed" (the files), "elapsed", "processes", "time"}  (--jobs)
+#   {"event": "watch", "state" ("changed", "up_to_date" or "stopped"), "files", "time"}  (directories)
+#   {"event": "cache", "hits", "misses", "evicted", "time"}  (--cache-dir)
+#
+# stage is "analyze" while the columns are analysed and "encode" once they are all drawn (and the
+# images are being encoded and saved). samples_per_second counts the frames of the audio, elapsed
+# and eta are seconds, time is the UNIX time of the event. Rates and eta are null while they aren't
+# known, e.g. for streams of unknown length.
+
+import json
+import sys
+import time
+
+# seconds between two progress events of a file, at most
+PROGRESS_INTERVAL = 0.5
+
+
+def write_json_line(event, stream=None):
+    stream = stream or sys.stdout
+    stream.write(json.dumps(event) + "\n")
+    stream.flush()
+
+
+class TextProgress:
+    """ prints 0% 10% ... 100% as the columns of a file get done """
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.printed = -1
+
+    def __call__(self, position, width):
+        decile = min(10, position * 10 // max(1, width))
+        if decile <= self.printed:
+            return
+        for done in range(self.printed + 1, decile + 1):
+            self.stream.write(f"{done * 10}% ")
+        self.printed = decile
+        self.stream.flush()
+
+
+class ProgressEvents:
+    """
+    A progress callback for rendering input_file, frames long (None if unknown), passing events
+    (dicts, see above) to emit: call start before rendering, the render calls the object itself and
+    finish once the images are saved. Progress events are sent at most every interval seconds (and
+    for the last column), so calling it costs a clock read, however often it is called.
+    """
+
+    def __init__(self, input_file, frames=None, emit=write_json_line, interval=PROGRESS_INTERVAL):
+        self.input_file = input_file
+        self.frames = frames
+        self.emit = emit
+        self.interval = interval
+        self.started = None
+        self.last_event = None
+
+    def event(self, name, **fields):
+        event = {"event": name, "file": self.input_file}
+        event.update(fields)
+        event["time"] = time.time()
+        self.emit(event)
+
+    def samples_per_second(self, fraction, elapsed):
+        if self.frames is None or elapsed <= 0:
+            return None
+        return fraction * self.frames / elapsed
+
+    def start(self):
+        self.started = self.last_event = time.perf_counter()
+        self.event("start", frames=self.frames)
+
+    def __call__(self, position, width):
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = self.last_event = now
+        if position < width and now - self.last_event < self.interval:
+            return
+        self.last_event = now
+
+        elapsed = now - self.started
+        fraction = position / float(width) if width else 1.0
+        eta = elapsed * (1.0 - fraction) / fraction if fraction > 0 else None
+        self.event("progress", stage="analyze" if position < width else "encode", columns_done=position,
+                   columns=width, samples_per_second=self.samples_per_second(fraction, elapsed),
+                   elapsed=elapsed, eta=eta)
+
+    def finish(self, error=None, elapsed=None):
+        """ elapsed is the time the render took, if it was measured elsewhere (see wav2png.py --jobs) """
+        if elapsed is None:
+            elapsed = time.perf_counter() - self.started if self.started is not None else 0.0
+        self.event("done", frames=self.frames, elapsed=elapsed,
+                   samples_per_second=None if error else self.samples_per_second(1.0, elapsed), error=error)
+
+    def cached(self):
+        """ the images of the file were taken from the cache instead """
+        self.event("cached")
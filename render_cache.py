@@ -0,0 +1,168 @@
+# render_cache.py
+# Content addressed cache of rendered images, see wav2png.py --cache-dir
+#
+# Entries are keyed on the audio content plus everything that changes the images and export data
+# (size, fft size, color scheme, which images are made, export format and rows), so renaming or
+# touching a file doesn't invalidate it while any change to the audio does. Cached images live in
+# <cache_dir>/<key[:2]>/<key><suffix>, their modification time is refreshed on every hit so
+# eviction can drop the least recently used ones.
+
+import hashlib
+import json
+import os
+import shutil
+
+from color_schemes import COLOR_SCHEMES, DEFAULT_COLOR_SCHEME_KEY
+
+# bump whenever rendering changes, so images of older versions are no longer used
+CACHE_VERSION = 2
+
+_DIGEST_INDEX = "digests.json"
+
+
+def file_digest(filename, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scheme_fingerprint(color_scheme):
+    """ hash of the contents of a color scheme (given by name or as a dict) """
+    if not isinstance(color_scheme, dict):
+        color_scheme = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES[DEFAULT_COLOR_SCHEME_KEY])
+    return hashlib.sha256(json.dumps(color_scheme, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    Images rendered before, by content. fetch() places cached images at the requested output paths,
+    store() adds freshly rendered ones. With max_size (bytes) the least recently used entries are
+    evicted once the cache grows beyond it. With link, outputs are hard links to the cached files
+    instead of copies (falling back to copies where linking isn't possible).
+    """
+
+    def __init__(self, cache_dir, max_size=None, link=False):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # content digests of files seen before, by path, size and mtime, so unchanged files are not
+        # read again just to find out they are unchanged
+        self.digest_index_filename = os.path.join(cache_dir, _DIGEST_INDEX)
+        try:
+            with open(self.digest_index_filename) as f:
+                self.digests = json.load(f)
+        except (OSError, ValueError):
+            self.digests = {}
+
+    def digest(self, input_filename):
+        stat = os.stat(input_filename)
+        path = os.path.abspath(input_filename)
+        size, mtime_ns, digest = self.digests.get(path, (None, None, None))
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            digest = file_digest(input_filename)
+            self.digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def key(self, input_filename, image_width, image_height, fft_size, color_scheme, suffixes, export_format=None,
+            export_rows=None):
+        """ cache key of rendering input_filename into the images with the given suffixes, and of
+        exporting its analysis data in export_format with export_rows spectrogram rows, if it is """
+        parts = [str(CACHE_VERSION), self.digest(input_filename), str(image_width), str(image_height), str(fft_size),
+                 scheme_fingerprint(color_scheme)] + sorted(suffixes)
+        if export_format is not None:
+            parts += ["export", export_format, str(export_rows)]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def entry_filename(self, key, suffix):
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def fetch(self, key, outputs):
+        """ place the cached images of key at outputs ({suffix: output filename}), returns False
+        (and places nothing) if any of them is not cached """
+        entries = {suffix: self.entry_filename(key, suffix) for suffix in outputs}
+        if not all(os.path.exists(entry) for entry in entries.values()):
+            self.misses += 1
+            return False
+
+        for suffix, entry in entries.items():
+            os.utime(entry)
+            self._place(entry, outputs[suffix])
+        self.hits += 1
+        return True
+
+    def store(self, key, outputs):
+        """ add the freshly rendered outputs ({suffix: output filename}) of key to the cache """
+        for suffix, output in outputs.items():
+            entry = self.entry_filename(key, suffix)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            self._place(output, entry)
+
+    def release(self, outputs):
+        """ remove existing outputs before rendering over them, they may be hard links to cached files
+        that would otherwise be overwritten too """
+        for output in outputs.values():
+            if self.link and os.path.exists(output):
+                os.remove(output)
+
+    def _place(self, source, destination):
+        temporary = destination + ".tmp"
+        if self.link:
+            try:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                os.link(source, temporary)
+                os.replace(temporary, destination)
+                return
+            except OSError:
+                pass
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, destination)
+
+    def evict(self):
+        """ remove least recently used entries until the cache is no larger than max_size """
+        if self.max_size is None:
+            return
+
+        entries = {}
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                stat = entry.stat()
+                key = entry.name[:64]
+                size, last_used, files = entries.get(key, (0, 0, []))
+                entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime), files + [entry.path])
+
+        total = sum(size for size, _, _ in entries.values())
+        for size, _, files in sorted(entries.values(), key=lambda entry: entry[1]):
+            if total <= self.max_size:
+                break
+            for filename in files:
+                os.remove(filename)
+            total -= size
+            self.evicted += 1
+
+    def save(self):
+        """ save the digest index for the next run """
+        temporary = self.digest_index_filename + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.digests, f)
+        os.replace(temporary, self.digest_index_filename)
+
+    def close(self):
+        """ evict what doesn't fit and save the digest index """
+        self.evict()
+        self.save()
+
+    def statistics(self):
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return f"cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate), {self.evicted} entries evicted"
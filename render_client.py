@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# render_client.py
+# Render files on a running render_server.py instead of in this process. Takes the options of
+# wav2png.py that the server supports and names the images the same way. Only uses the standard
+# library, so it starts without loading numpy, PIL or soundfile.
+
+import argparse
+import json
+import os
+import sys
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SERVER = "http://127.0.0.1:8765"
+
+# as checked by render_server.py
+TOKEN_HEADER = "X-Render-Token"
+TOKEN_VARIABLE = "WAV2PNG_RENDER_TOKEN"
+
+# as named by wav2png.py --export
+EXPORT_SUFFIXES = {"binary": "_data.a2d", "json": "_data.json"}
+
+
+def request(server, path, body=None, token=None):
+    """ send a request to the server, returns (status, JSON answer) """
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers[TOKEN_HEADER] = token
+    req = urllib.request.Request(server.rstrip("/") + path, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def render(server, input_file, args):
+    # the server may run in another directory
+    input_file = os.path.abspath(input_file)
+    images = not args.export_only
+    body = {
+        "input_file": input_file,
+        "output_file_w": input_file + "_w.png" if images else None,
+        "output_file_s": input_file + "_s.jpg" if images and not args.waveform_only else None,
+        "width": args.width,
+        "height": args.height,
+        "fft_size": args.fft_size,
+        "color_scheme": args.color_scheme,
+        "profile": args.profile,
+    }
+    if args.export or args.export_only:
+        body.update({"export_file": input_file + EXPORT_SUFFIXES[args.export_format],
+                     "export_format": args.export_format,
+                     "export_rows": 0 if args.waveform_only else args.export_rows})
+    return request(server, "/render", body, args.token)
+
+
+def main(args):
+    if args.stats or args.health:
+        status, answer = request(args.server, "/stats" if args.stats else "/health")
+        print(json.dumps(answer, indent=1))
+        return 0 if status == 200 else 1
+
+    failed = 0
+    # several requests at once, so all of the server's workers are used
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [(input_file, executor.submit(render, args.server, input_file, args)) for input_file in args.files]
+        for input_file, future in futures:
+            try:
+                status, answer = future.result()
+            except urllib.error.URLError as e:
+                print(f"{input_file}: FAILED (server {args.server} not reachable: {e.reason})")
+                failed += 1
+                continue
+            error = answer.get("error")
+            if error:
+                print(f"{input_file}: FAILED ({error})")
+                failed += 1
+            else:
+                print(f"{input_file}: done in {answer['seconds']:.2f}s (queued {answer['queued']:.2f}s)")
+            if args.profile and answer.get("stats"):
+                from render_stats import format_stats
+                print(format_stats(answer["stats"]))
+            sys.stdout.flush()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", help="files to process", nargs="*")
+    parser.add_argument("--server", type=str, default=DEFAULT_SERVER, dest="server",
+                        help="URL of the render_server.py to use")
+    parser.add_argument("--token", type=str, default=os.environ.get(TOKEN_VARIABLE), dest="token",
+                        help=f"the token the server printed when it started (default: ${TOKEN_VARIABLE})")
+    parser.add_argument("--token-file", type=str, default=None, dest="token_file",
+                        help="read the token from this file, see render_server.py --token-file")
+    parser.add_argument("-w", "--width", type=int, default=500, dest="width",
+                        help="image width in pixels")
+    parser.add_argument("-H", "--height", type=int, default=171, dest="height",
+                        help="image height in pixels")
+    parser.add_argument("-f", "--fft", type=int, default=2048, dest="fft_size",
+                        help="fft size, power of 2 for increased performance")
+    parser.add_argument("-c", "--color_scheme", type=str, default='BleepBloop', dest="color_scheme",
+                        help="name of the color scheme to use")
+    parser.add_argument("-j", "--jobs", type=int, default=4, dest="jobs",
+                        help="number of files to submit at once")
+    parser.add_argument("--waveform-only", action="store_true", dest="waveform_only",
+                        help="don't create the spectrogram image")
+    parser.add_argument("--export", action="store_true", dest="export",
+                        help="also write the analysis data the images are drawn from, see wav2png.py --export")
+    parser.add_argument("--export-only", action="store_true", dest="export_only",
+                        help="write only the --export data, no images")
+    parser.add_argument("--export-format", choices=sorted(EXPORT_SUFFIXES), default="binary", dest="export_format",
+                        help="format of the --export data")
+    parser.add_argument("--export-rows", type=int, default=None, dest="export_rows",
+                        help="spectrogram rows of the --export data, see wav2png.py --export-rows")
+    parser.add_argument("--profile", action="store_true", dest="profile",
+                        help="print the per stage stats the server measured for each file")
+    parser.add_argument("--stats", action="store_true", dest="stats",
+                        help="print the queue depth, counts and latency percentiles of the server")
+    parser.add_argument("--health", action="store_true", dest="health",
+                        help="print the state of the server's workers, exits with 1 if they are unhealthy")
+
+    args = parser.parse_args()
+    if not args.files and not (args.stats or args.health):
+        parser.error("no files given")
+    if args.token_file:
+        with open(args.token_file) as f:
+            args.token = f.read().strip()
+    if args.files and not args.token:
+        parser.error(f"no --token given (nor --token-file or ${TOKEN_VARIABLE}), see what render_server.py printed")
+    sys.exit(main(args))
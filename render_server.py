@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# render_server.py
+# Render daemon: a local HTTP server with a pool of worker processes that have numpy, soundfile
+# and PIL imported already, so a render doesn't pay for starting an interpreter (or unpacking the
+# bundled executable) first. render_client.py submits files to it.
+#
+# Render requests have to be JSON (Content-Type: application/json) and carry the token the server
+# prints when it starts (a new one every launch) in the TOKEN_HEADER header. Their images and
+# export files have to be below the output root (--output-root, the working directory by default).
+# All requests have to name the server's own address in their Host header, so web pages in a
+# browser can't reach it through a DNS name of theirs pointing at it.
+#
+#   POST /render   {"input_file", "output_file_w", "output_file_s" (null for none), "width", "height",
+#                   "fft_size", "color_scheme", "profile", "export_file", "export_format",
+#                   "export_rows"} (see batch.RenderJob), answered once rendered with
+#                   {"error", "seconds" (rendering), "queued" (waiting for a worker), "stats"}
+#   GET  /stats    queue depth, counts and latency percentiles
+#   GET  /health   whether the workers respond, 503 if they don't
+
+import argparse
+import hmac
+import ipaddress
+import json
+import multiprocessing
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch import RenderJob, RenderResult, render_job, warm_up
+
+DEFAULT_PORT = 8765
+
+TOKEN_HEADER = "X-Render-Token"
+
+# latencies kept for the percentiles
+LATENCY_WINDOW = 1000
+
+HEALTH_TIMEOUT = 5.0
+
+
+def percentiles(values):
+    """ p50, p90 and p99 of values (None while there are none) """
+    ordered = sorted(values)
+    return {name: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else None
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))}
+
+
+class RenderService:
+    """ the worker pool and the statistics of the jobs it ran """
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.queue_times = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+        self.executor = self.start_pool()
+
+    def start_pool(self):
+        # spawned rather than forked (as on Windows), forked workers would keep the server's socket open
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        # one warm up per worker, so the imports happen before the first job. The pool starts all of
+        # its processes when the first task is submitted (they may import in any order)
+        for future in [executor.submit(warm_up) for _ in range(self.workers)]:
+            future.result()
+        return executor
+
+    def restart_pool(self, broken):
+        """ replace a pool whose workers died (unless another thread did already) """
+        with self.lock:
+            if self.executor is not broken:
+                return
+            self.restarts += 1
+            broken.shutdown(wait=False)
+            self.executor = self.start_pool()
+
+    def render(self, job):
+        """ render job on the pool, returns (result, seconds waiting for a worker) """
+        submitted = time.perf_counter()
+        with self.lock:
+            self.submitted += 1
+            executor = self.executor
+
+        for attempt in range(2):
+            try:
+                result = executor.submit(render_job, job).result()
+                break
+            except BrokenProcessPool as e:
+                # a worker died (crashed, or was killed for its memory), the pool can't be used anymore.
+                # That may have been another job's worker, so this one is tried once more on a new pool
+                result = RenderResult(job, f"{type(e).__name__}: {e}", 0.0)
+                self.restart_pool(executor)
+                with self.lock:
+                    executor = self.executor
+
+        latency = time.perf_counter() - submitted
+        queued = max(0.0, latency - result.seconds)
+        with self.lock:
+            self.completed += 1
+            if result.error:
+                self.failed += 1
+            self.latencies.append(latency)
+            self.queue_times.append(queued)
+        return result, queued
+
+    def statistics(self):
+        with self.lock:
+            in_flight = self.submitted - self.completed
+            latencies = list(self.latencies)
+            queue_times = list(self.queue_times)
+            return {
+                "workers": self.workers,
+                "in_flight": in_flight,
+                "queue_depth": max(0, in_flight - self.workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "pool_restarts": self.restarts,
+                "uptime": time.time() - self.started,
+                "latency": percentiles(latencies),
+                "queued": percentiles(queue_times),
+            }
+
+    def health(self):
+        """ (healthy, details), healthy if all workers are alive and, unless they are all busy, the
+        pool answers a ping (when they are, the ping would wait for a render) """
+        with self.lock:
+            busy = self.submitted - self.completed >= self.workers
+        alive = len(multiprocessing.active_children())
+        responding = None
+        if not busy:
+            try:
+                self.executor.submit(warm_up).result(timeout=HEALTH_TIMEOUT)
+                responding = True
+            except (TimeoutError, BrokenProcessPool):
+                responding = False
+        healthy = alive >= self.workers and responding is not False
+        return healthy, {"workers": self.workers, "alive": alive, "busy": busy, "responding": responding,
+                         "pool_restarts": self.restarts}
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def job_from_request(request):
+    """ a RenderJob from the JSON of a /render request, raises ValueError for invalid ones """
+    try:
+        job = RenderJob(str(request["input_file"]), request.get("output_file_w") and str(request["output_file_w"]),
+                        request.get("output_file_s") and str(request["output_file_s"]),
+                        int(request.get("width", 500)), int(request.get("height", 171)),
+                        int(request.get("fft_size", 2048)), request.get("color_scheme"),
+                        bool(request.get("profile", False)),
+                        request.get("export_file") and str(request["export_file"]),
+                        str(request.get("export_format", "binary")),
+                        None if request.get("export_rows") is None else int(request["export_rows"]))
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"invalid render request: {e!r}")
+    if not job.output_file_w and not job.export_file:
+        raise ValueError("invalid render request: neither output_file_w nor export_file")
+    return job
+
+
+def check_outputs(job, output_root):
+    """ raises PermissionError if a file job writes is not below the directory output_root (symbolic
+    links resolved) """
+    root = os.path.realpath(output_root)
+    for filename in (job.output_file_w, job.output_file_s, job.export_file):
+        if filename and os.path.commonpath([root, os.path.realpath(filename)]) != root:
+            raise PermissionError(f"{filename} is not below the output root {output_root}")
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    service = None  # the RenderService, set on the server class
+    token = None  # the token render requests have to send
+    output_root = None  # the directory render requests have to write below
+    allowed_hosts = ()  # host names the Host header may name besides the server's addresses
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def host_allowed(self):
+        """ whether the Host header names the address (or an allowed name) and port the request came
+        in on. Without it (HTTP/1.0) there's nothing a page in a browser could have pointed at us """
+        host = self.headers.get("Host")
+        if host is None:
+            return True
+        if host.startswith("["):
+            # an IPv6 address
+            name, _, port = host[1:].partition("]")
+            port = port[1:]
+        else:
+            name, _, port = host.partition(":")
+        name = name.lower()
+        address, server_port = self.connection.getsockname()[:2]
+        if (port or "80") != str(server_port):
+            return False
+        if name in self.allowed_hosts:
+            return True
+        if name == "localhost":
+            return is_loopback(address)
+        try:
+            return ipaddress.ip_address(name) == ipaddress.ip_address(address.split("%")[0])
+        except ValueError:
+            return False
+
+    def do_GET(self):
+        if not self.host_allowed():
+            self.send_json(403, {"error": "Host header doesn't name this server"})
+        elif self.path == "/stats":
+            self.send_json(200, self.service.statistics())
+        elif self.path == "/health":
+            healthy, details = self.service.health()
+            self.send_json(200 if healthy else 503, details)
+        else:
+            self.send_json(404, {"error": f"no such path {self.path}"})
+
+    def do_POST(self):
+        if not self.host_allowed():
+            self.send_json(403, {"error": "Host header doesn't name this server"})
+            return
+        if self.path != "/render":
+            self.send_json(404, {"error": f"no such path {self.path}"})
+            return
+        if not hmac.compare_digest(self.headers.get(TOKEN_HEADER, "").encode("utf-8"), self.token.encode("utf-8")):
+            self.send_json(403, {"error": f"missing or wrong {TOKEN_HEADER}, see the token the server printed"})
+            return
+        if self.headers.get_content_type() != "application/json":
+            self.send_json(415, {"error": "render requests have to be application/json"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = job_from_request(json.loads(self.rfile.read(length)))
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        try:
+            check_outputs(job, self.output_root)
+        except PermissionError as e:
+            self.send_json(403, {"error": str(e)})
+            return
+
+        result, queued = self.service.render(job)
+        self.send_json(200, {"input_file": job.input_file, "error": result.error, "seconds": result.seconds,
+                             "queued": queued, "stats": result.stats})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, workers=None, verbose=False, output_root=None, token_file=None,
+          allowed_hosts=()):
+    """ serve render requests until stopped. Outputs have to be below output_root (the working
+    directory if None), the token they need is printed and, if given, written to token_file """
+    token = secrets.token_urlsafe(24)
+    output_root = os.path.abspath(output_root or os.getcwd())
+    handler = type("Handler", (RenderRequestHandler,), {
+        "token": token, "output_root": output_root,
+        "allowed_hosts": tuple(name.lower() for name in allowed_hosts)})
+    # bound before the workers are started, so a port in use fails right away
+    server = ThreadingHTTPServer((host, port), handler)
+    server.verbose = verbose
+    if token_file:
+        # readable by this user only
+        with open(os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            f.write(token)
+    service = handler.service = RenderService(workers)
+    # stopped like with Ctrl+C, shutting the workers down
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"rendering on http://{host}:{server.server_address[1]} with {service.workers} workers, "
+          f"writing below {output_root}")
+    print(f"token: {token}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on, the default only accepts local clients")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--output-root", default=None, dest="output_root",
+                        help="directory the images and export files have to be written below "
+                             "(default: the working directory)")
+    parser.add_argument("--token-file", default=None, dest="token_file",
+                        help="also write the token clients have to send to this file, see render_client.py --token-file")
+    parser.add_argument("--allowed-host", action="append", default=[], dest="allowed_hosts",
+                        help="a host name clients reach the server by, besides its addresses and localhost")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.verbose, args.output_root, args.token_file, args.allowed_hosts)
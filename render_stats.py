@@ -0,0 +1,154 @@
+# render_stats.py
+# Per stage measurements of a render, see create_wave_images(stats=...) and wav2png.py --profile
+#
+# The stages of a render are:
+#   decode              reading (and decoding) samples
+#   peaks               finding the peaks of the columns
+#   fft                 windowing and FFT of the analysis frames
+#   analyze             all of the above, when it runs on worker processes (create_wave_images
+#                       workers > 1), whose own stages aren't seen from here
+#   features            normalizing spectra, db spectra and spectral centroids
+#   draw_waveform, draw_spectrogram, encode_waveform, encode_spectrogram
+#   export              writing the analysis data (see export.py)
+#
+# Memory is the peak resident memory (the peak working set on Windows) of the process, which the
+# systems keep for the whole life of the process and can't be reset. In worker processes
+# (--jobs, render_server.py) it includes the files rendered before, a render only set it if it
+# is higher than the peak before the render started.
+
+import contextlib
+import sys
+import time
+
+try:
+    # not available on Windows, see _peak_working_set there
+    import resource
+except ImportError:
+    resource = None
+
+_NO_STAGE = contextlib.nullcontext()
+
+_memory_counters = None
+
+
+def _peak_working_set():
+    """ PeakWorkingSetSize of GetProcessMemoryInfo, on Windows """
+    global _memory_counters
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.windll.kernel32
+    if _memory_counters is None:
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        kernel32.K32GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS),
+                                                     wintypes.DWORD]
+        _memory_counters = PROCESS_MEMORY_COUNTERS()
+        _memory_counters.cb = ctypes.sizeof(_memory_counters)
+
+    if not kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(_memory_counters),
+                                            _memory_counters.cb):
+        return None
+    return _memory_counters.PeakWorkingSetSize
+
+
+def peak_rss():
+    """ peak resident memory of this process so far (over its whole life) in bytes, None where it
+    can't be measured """
+    if resource is None:
+        if sys.platform != "win32":
+            return None
+        try:
+            return _peak_working_set()
+        except (OSError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def stage(stats, name):
+    """ context measuring stage name into stats, which may be None to measure nothing """
+    return _NO_STAGE if stats is None else stats.stage(name)
+
+
+class RenderStats:
+    """
+    Wall and CPU time, samples and bytes processed, and the peak memory of the process at the end of
+    every stage of a render, plus the size of the files it wrote. hook, if given, is called with
+    (name, record) at the end of every stage, record being the dict of its totals so far.
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.stages = {}
+        self.outputs = {}
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.start_peak_rss = peak_rss()
+
+    def record(self, name):
+        if name not in self.stages:
+            self.stages[name] = {"calls": 0, "wall": 0.0, "cpu": 0.0, "samples": 0, "bytes": 0,
+                                 "process_peak_rss": None}
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        record = self.record(name)
+        start_wall = time.perf_counter()
+        # stages may run on threads of their own (see processing.prefetched), so only this thread's time
+        start_cpu = time.thread_time()
+        try:
+            yield record
+        finally:
+            record["calls"] += 1
+            record["wall"] += time.perf_counter() - start_wall
+            record["cpu"] += time.thread_time() - start_cpu
+            record["process_peak_rss"] = peak_rss()
+            if self.hook:
+                self.hook(name, record)
+
+    def count(self, name, samples=0, bytes=0):
+        """ add samples and bytes processed to stage name """
+        record = self.record(name)
+        record["samples"] += samples
+        record["bytes"] += bytes
+
+    def output(self, name, filename, size):
+        """ remember that stage name wrote size bytes to filename """
+        self.outputs[name] = {"filename": filename, "bytes": size}
+
+    def as_dict(self):
+        return {
+            "wall": time.perf_counter() - self.start_wall,
+            "cpu": time.process_time() - self.start_cpu,
+            "process_peak_rss": peak_rss(),
+            "process_peak_rss_before": self.start_peak_rss,
+            "stages": self.stages,
+            "outputs": self.outputs,
+        }
+
+    def report(self):
+        return format_stats(self.as_dict())
+
+
+def format_stats(stats):
+    """ stats (see RenderStats.as_dict) as a table, slowest stage first """
+    lines = [f"{'stage':<20}{'calls':>7}{'wall':>10}{'cpu':>10}{'samples':>14}{'MB':>10}"]
+    for name, record in sorted(stats["stages"].items(), key=lambda item: -item[1]["wall"]):
+        lines.append(f"{name:<20}{record['calls']:>7}{record['wall']:>9.3f}s{record['cpu']:>9.3f}s"
+                     f"{record['samples']:>14}{record['bytes'] / 1e6:>10.1f}")
+    lines.append(f"{'total':<20}{'':>7}{stats['wall']:>9.3f}s{stats['cpu']:>9.3f}s")
+    for name, output in stats["outputs"].items():
+        lines.append(f"{name}: {output['filename']} ({output['bytes']} bytes)")
+    if stats["process_peak_rss"] is not None:
+        before = stats["process_peak_rss_before"]
+        lines.append(f"peak memory of the process: {stats['process_peak_rss'] / 1e6:.1f} MB"
+                     + (f" ({before / 1e6:.1f} MB before this render)" if before is not None else ""))
+    return "\n".join(lines)
@@ -0,0 +1,211 @@
+# sidecar.py
+# Analysis files (.a2i) stored next to the audio, so waveforms can be rendered at any width
+# without decoding the audio again. See create_wave_images(sidecar_filename=...)
+#
+# File layout (little endian):
+#   magic b"A2I\0", version (uint16), reserved (uint16), header length (uint32)
+#   JSON header: audio header metadata, max level, and for every level of the pyramid its samples
+#                per pixel, column count and offset of its data in the file
+#   one float32 array of shape (count, 3) per level, 16 byte aligned: first peak, second peak and
+#   spectral centroid of every column. Level n has BASE_SAMPLES_PER_PIXEL * 2 ** n samples per
+#   column, the last level has a single column.
+
+import json
+import mmap
+import os
+import struct
+
+import numpy
+import soundfile as sf
+
+from processing import (AudioProcessor, AudioProcessingException, WaveformImage, merge_peaks,
+                        ANALYSIS_BLOCK_SIZE, DRAW_BLOCK_SIZE)
+
+SIDECAR_MAGIC = b"A2I\0"
+SIDECAR_VERSION = 2
+SIDECAR_EXTENSION = ".a2i"
+
+# samples per column of the finest level, must be a power of two
+BASE_SAMPLES_PER_PIXEL = 256
+
+_PREAMBLE = struct.Struct("<4sHHI")
+_ALIGNMENT = 16
+
+
+def sidecar_filename_for(input_filename):
+    return input_filename + SIDECAR_EXTENSION
+
+
+def source_stat(input_filename):
+    stat = os.stat(input_filename)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def build_levels(processor, base_samples_per_pixel=BASE_SAMPLES_PER_PIXEL):
+    """
+    Analyse the audio of processor in columns of base_samples_per_pixel samples and reduce them to
+    ever coarser levels. Returns the list of (count, 3) float32 level arrays, finest first.
+    """
+    n_columns = max(1, -(-processor.nframes // base_samples_per_pixel))
+    seek_points = numpy.minimum(numpy.arange(n_columns + 1, dtype=numpy.int64) * base_samples_per_pixel,
+                                processor.nframes)
+    columns_per_block = max(1, ANALYSIS_BLOCK_SIZE // max(base_samples_per_pixel, processor.fft_size))
+
+    level = numpy.empty((n_columns, 3), dtype=numpy.float32)
+    for x0 in range(0, n_columns, columns_per_block):
+        x1 = min(x0 + columns_per_block, n_columns)
+        peaks, raw_spectra = processor.analyze_columns(seek_points[x0:x1 + 1])
+        level[x0:x1, :2] = peaks
+        # the centroid doesn't depend on the normalization, only its "is there any energy at all"
+        # threshold does, which is applied to the raw spectrum here
+        level[x0:x1, 2] = processor.spectral_centroids(raw_spectra)
+
+    levels = [level]
+    while len(level) > 1:
+        boundaries = numpy.append(numpy.arange(0, len(level), 2), len(level))
+        coarser = numpy.empty((len(boundaries) - 1, 3), dtype=numpy.float32)
+        coarser[:, :2] = merge_peaks(level[:, :2], boundaries)
+        coarser[:, 2] = numpy.add.reduceat(level[:, 2], boundaries[:-1]) / numpy.diff(boundaries)
+        levels.append(coarser)
+        level = coarser
+
+    return levels
+
+
+def write_sidecar(input_filename, sidecar_filename=None, fft_size=2048,
+                  base_samples_per_pixel=BASE_SAMPLES_PER_PIXEL):
+    """ analyse input_filename and write its sidecar, returns the sidecar filename """
+    sidecar_filename = sidecar_filename or sidecar_filename_for(input_filename)
+
+    processor = AudioProcessor(input_filename, fft_size, numpy.hanning, normalize=False)
+    try:
+        levels = build_levels(processor, base_samples_per_pixel)
+        header = {
+            "samplerate": processor.samplerate,
+            "channels": processor.audio_file.channels,
+            "frames": processor.nframes,
+            "format": processor.audio_file.format,
+            "subtype": processor.audio_file.subtype,
+            "fft_size": fft_size,
+            "max_level": float(numpy.abs(levels[-1][0, :2]).max()),
+            "levels": [],
+        }
+    finally:
+        processor.audio_file.close()
+    header.update(source_stat(input_filename))
+
+    # the header length depends on the offsets in it, so lay out the data after a generous guess
+    offset = _PREAMBLE.size + len(json.dumps(header)) + 64 * (len(levels) + 1)
+    for level in levels:
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        header["levels"].append({"samples_per_pixel": base_samples_per_pixel * 2 ** len(header["levels"]),
+                                 "count": len(level), "offset": offset})
+        offset += level.nbytes
+
+    encoded_header = json.dumps(header).encode("utf-8")
+    temporary_filename = sidecar_filename + ".tmp"
+    with open(temporary_filename, "wb") as f:
+        f.write(_PREAMBLE.pack(SIDECAR_MAGIC, SIDECAR_VERSION, 0, len(encoded_header)))
+        f.write(encoded_header)
+        for level, info in zip(levels, header["levels"]):
+            f.write(b"\0" * (info["offset"] - f.tell()))
+            f.write(level.astype("<f4").tobytes())
+    os.replace(temporary_filename, sidecar_filename)
+
+    return sidecar_filename
+
+
+class AnalysisSidecar:
+    """
+    A memory mapped sidecar file, the levels are only read from disk as far as they are used.
+    close() unmaps it.
+    """
+
+    def __init__(self, sidecar_filename):
+        with open(sidecar_filename, "rb") as f:
+            preamble = f.read(_PREAMBLE.size)
+            if len(preamble) < _PREAMBLE.size:
+                raise AudioProcessingException(f"{sidecar_filename} is not an analysis sidecar")
+            magic, version, _, header_length = _PREAMBLE.unpack(preamble)
+            if magic != SIDECAR_MAGIC:
+                raise AudioProcessingException(f"{sidecar_filename} is not an analysis sidecar")
+            if version != SIDECAR_VERSION:
+                raise AudioProcessingException(f"{sidecar_filename} has unsupported version {version}")
+            self.header = json.loads(f.read(header_length).decode("utf-8"))
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.filename = sidecar_filename
+        self.nframes = self.header["frames"]
+        try:
+            self.levels = [numpy.frombuffer(self.mapping, dtype="<f4", count=info["count"] * 3,
+                                            offset=info["offset"]).reshape(info["count"], 3)
+                           for info in self.header["levels"]]
+        except (ValueError, KeyError):
+            self.levels = []
+            self.mapping.close()
+            raise
+
+    def is_current(self, input_filename, fft_size):
+        """ whether this sidecar was made from input_filename as it is now, with fft_size """
+        try:
+            stat = source_stat(input_filename)
+        except OSError:
+            return False
+        return (self.header["source_size"] == stat["source_size"] and
+                self.header["source_mtime_ns"] == stat["source_mtime_ns"] and
+                self.header["fft_size"] == fft_size)
+
+    def waveform_columns(self, image_width):
+        """ peaks and spectral centroids of the columns of an image_width wide waveform, taken from
+        the coarsest level that still has at least one column per image column """
+        samples_per_pixel = self.nframes / float(image_width)
+        seek_points = (numpy.arange(image_width + 1) * samples_per_pixel).astype(numpy.int64)
+
+        infos = self.header["levels"]
+        n = 0
+        while n + 1 < len(infos) and infos[n + 1]["samples_per_pixel"] <= samples_per_pixel:
+            n += 1
+        level = self.levels[n]
+        boundaries = seek_points // infos[n]["samples_per_pixel"]
+        boundaries[-1] = len(level)  # including the partial last column of the level
+
+        if samples_per_pixel < infos[n]["samples_per_pixel"]:
+            # more image columns than level columns, every image column shows the one it starts in
+            columns = level[numpy.minimum(boundaries[:-1], len(level) - 1)]
+            return numpy.array(columns[:, :2]), numpy.array(columns[:, 2], dtype=numpy.float64)
+
+        peaks = merge_peaks(level[:, :2], boundaries)
+        centroids = numpy.add.reduceat(level[:, 2], boundaries[:-1], dtype=numpy.float64) / numpy.diff(boundaries)
+        return peaks, centroids
+
+    def close(self):
+        """ unmap the file, the sidecar can't be used anymore. Windows can't replace or remove a
+        file while it is mapped. The arrays waveform_columns returned are copies, and stay valid """
+        self.levels = []
+        self.mapping.close()
+
+    def render_waveform(self, output_filename, image_width, image_height, color_scheme=None):
+        peaks, centroids = self.waveform_columns(image_width)
+
+        waveform = WaveformImage(image_width, image_height, color_scheme)
+        for x0 in range(0, image_width, DRAW_BLOCK_SIZE):
+            waveform.draw_columns(x0, peaks[x0:x0 + DRAW_BLOCK_SIZE], centroids[x0:x0 + DRAW_BLOCK_SIZE])
+        waveform.save(output_filename)
+
+
+def load_sidecar(input_filename, sidecar_filename=None, fft_size=2048):
+    """ open the sidecar of input_filename, (re)building it first if it is missing or out of date """
+    sidecar_filename = sidecar_filename or sidecar_filename_for(input_filename)
+
+    sidecar = None
+    try:
+        sidecar = AnalysisSidecar(sidecar_filename)
+        if sidecar.is_current(input_filename, fft_size):
+            return sidecar
+    except (OSError, ValueError, KeyError, AudioProcessingException):
+        pass
+    if sidecar is not None:
+        # unmapped before it is replaced
+        sidecar.close()
+
+    return AnalysisSidecar(write_sidecar(input_filename, sidecar_filename, fft_size))
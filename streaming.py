@@ -0,0 +1,295 @@
+# streaming.py
+# Render audio that is read once, front to back, a block at a time: files of any length and
+# streams without a known length, like stdin. See wav2png.py --stream
+#
+# Only the samples still needed are kept, which is less than a block plus an FFT frame: peaks of a
+# column are merged block by block as its samples come in and its spectrum is taken as soon as the
+# FFT frame around its start is complete. Memory so depends on the image, not on the audio.
+#
+# If the number of frames is known up front (from the file header, or a duration hint) the columns
+# are the same as create_wave_images uses. Otherwise the audio is split in bins of a power of two
+# samples, starting at one sample per bin, and a spectrum is taken at the start of every
+# PEAK_BINS_PER_SPECTRUM-th bin. Whenever the bins are full, neighbours are merged into bins twice
+# as long (peaks merged, every other spectrum dropped), so there are always between image_width
+# and 2 * image_width spectra (at least MIN_STREAM_SPECTRA), and finer peaks, which are mapped onto
+# the columns once the stream ends.
+
+import contextlib
+import sys
+
+import numpy
+import soundfile as sf
+
+from processing import (AudioProcessor, AudioProcessingException, ordered_peaks, merge_peaks, draw_images,
+                        prefetched, ANALYSIS_BLOCK_SIZE)
+from render_stats import stage
+
+# frames read from the stream at once
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# peaks are kept finer than spectra for streams of unknown length, so column edges are off by at
+# most this fraction of a spectrum bin once mapped onto the columns. They are cheap, spectra are not
+PEAK_BINS_PER_SPECTRUM = 8
+
+# narrow images still get at least this many spectra (before mapping onto the columns)
+MIN_STREAM_SPECTRA = 256
+
+STDIN_FILENAME = "-"
+
+
+class StreamAnalyzer:
+    """
+    Peaks and raw spectra of image_width columns of audio fed (left channel only, float32) a block
+    at a time with feed. total_frames is the length of the audio if known. finish returns
+    (peaks, raw_spectra) like analyze_audio does, and sets the max level of the processor.
+    """
+
+    def __init__(self, processor, image_width, total_frames=None):
+        self.processor = processor
+        self.image_width = image_width
+        self.total_frames = total_frames
+        self.half_fft = processor.fft_size // 2
+
+        if total_frames is not None:
+            samples_per_pixel = total_frames / float(image_width)
+            self.bounds = (numpy.arange(image_width + 1) * samples_per_pixel).astype(numpy.int64)
+            self.stride = 1
+            self.capacity = image_width
+        else:
+            self.bounds = None
+            self.samples_per_bin = 1
+            self.stride = PEAK_BINS_PER_SPECTRUM
+            self.capacity = 2 * max(image_width, MIN_STREAM_SPECTRA) * self.stride
+
+        self.peaks = numpy.zeros((self.capacity + 1, 2), dtype=numpy.float32)
+        self.spectra = None
+        self.n_peaks = 0  # bins whose peaks are complete
+        self.n_spectra = 0  # spectra done, spectrum i is at the start of bin i * stride
+        self.pending = None  # peaks of the samples of bin n_peaks seen so far
+
+        self.position = 0  # frames fed so far
+        self.peak_position = 0  # frames accounted for in the peaks
+        # the samples still needed, from tail_start on. The first FFT frame starts before the audio
+        self.tail = numpy.zeros(self.half_fft, dtype=numpy.float32)
+        self.tail_start = -self.half_fft
+
+    def bin_starts(self, first, last):
+        """ the first frame of the bins first up to (not including) last """
+        if self.bounds is not None:
+            return self.bounds[first:last]
+        return numpy.arange(first, last, dtype=numpy.int64) * self.samples_per_bin
+
+    def bins_before(self, position):
+        """ the number of bins starting before position """
+        if self.bounds is not None:
+            return int(numpy.searchsorted(self.bounds[:-1], position))
+        return -(-position // self.samples_per_bin)
+
+    def spectrum_starts(self, first, last):
+        """ the frames the spectra first up to (not including) last are centered around """
+        return self.bin_starts(first * self.stride, (last - 1) * self.stride + 1)[::self.stride]
+
+    def spectra_before(self, position):
+        """ the number of spectra centered around a frame before position """
+        if self.bounds is not None:
+            return min(self.bins_before(position), self.image_width)
+        return -(-position // (self.samples_per_bin * self.stride))
+
+    def feed(self, samples):
+        if self.total_frames is not None and self.position + len(samples) > self.total_frames:
+            # longer than announced, there are no columns for the rest
+            samples = samples[:max(0, self.total_frames - self.position)]
+        self.tail = numpy.concatenate((self.tail, samples))
+        self.position += len(samples)
+
+        while self.advance(final=False):
+            self.merge_bins()
+        self.trim()
+
+    def finish(self):
+        if self.position == 0:
+            raise AudioProcessingException("no audio in the stream")
+
+        # the FFT frames of the last columns reach past the end, as with a file they are zero padded
+        self.tail = numpy.concatenate((self.tail, numpy.zeros(self.half_fft + 1, dtype=numpy.float32)))
+        self.advance(final=True)
+
+        peaks = self.peaks[:self.n_peaks]
+        spectra = self.spectra[:self.n_spectra]
+
+        if self.bounds is None:
+            peaks, spectra = self.columns(peaks, spectra)
+        elif self.n_peaks < self.image_width:
+            # columns past the end of a stream shorter than announced stay silent
+            missing = self.image_width - self.n_peaks
+            peaks = numpy.concatenate((peaks, numpy.zeros((missing, 2), dtype=peaks.dtype)))
+            spectra = numpy.concatenate((spectra, numpy.zeros((missing, spectra.shape[1]), dtype=spectra.dtype)))
+
+        self.processor.nframes = self.position
+        self.processor.set_max_level(max(0, numpy.abs(peaks).max()))
+        return peaks, spectra
+
+    def advance(self, final):
+        """ complete the peaks and spectra of as many bins as the samples fed so far allow, returns
+        True if the bins are full (and need to be merged before going on) """
+        end = self.position
+
+        # peaks: a bin is complete once the sample after it is in, an empty bin needs its first one
+        first = self.n_peaks
+        if final:
+            complete = self.bins_before(end) - first
+        elif self.bounds is not None:
+            complete = int(numpy.searchsorted(self.bounds[1:], end)) - first
+        else:
+            complete = (end - 1) // self.samples_per_bin - first
+        full = not final and complete >= self.capacity - first
+        if full:
+            # the samples after the last bin that fits are left for after merging
+            complete = self.capacity - first
+        complete = max(0, complete)
+
+        boundaries = numpy.concatenate(([self.peak_position],
+                                        numpy.minimum(self.bin_starts(first + 1, first + complete + 1), end)))
+        has_rest = not full and boundaries[-1] < end
+        if has_rest:
+            boundaries = numpy.append(boundaries, end)
+
+        if len(boundaries) > 1:
+            with stage(self.processor.stats, "peaks"):
+                rows = ordered_peaks(self.tail, boundaries - self.tail_start)
+                if self.pending is not None:
+                    # the first row continues the bin the previous block ended in
+                    rows[0] = self.pending if boundaries[1] == boundaries[0] else merge_peaks(
+                        numpy.stack((self.pending, rows[0])), [0, 2])[0]
+            if self.processor.stats:
+                n_samples = int(boundaries[-1] - boundaries[0])
+                self.processor.stats.count("peaks", n_samples, n_samples * self.tail.itemsize)
+            self.peaks[first:first + complete] = rows[:complete]
+            self.pending = rows[complete] if has_rest else None
+            self.n_peaks += complete
+            self.peak_position = int(boundaries[-1])
+
+        # spectra: one is done once the FFT frame centered around its start is in
+        first = self.n_spectra
+        if final:
+            last = self.spectra_before(end)
+        else:
+            last = min(self.spectra_before(end - self.half_fft + 1), self.capacity // self.stride + 1)
+        # a block can complete many short bins at once, their frames are windowed a batch at a time
+        frames_per_batch = max(1, ANALYSIS_BLOCK_SIZE // self.processor.fft_size)
+        for batch_first in range(first, last, frames_per_batch):
+            batch_last = min(batch_first + frames_per_batch, last)
+            frame_starts = self.spectrum_starts(batch_first, batch_last) - self.half_fft - self.tail_start
+            spectra = self.processor.frame_spectra(self.tail, frame_starts)
+            if self.spectra is None:
+                self.spectra = numpy.zeros((self.capacity // self.stride + 1, spectra.shape[1]), dtype=spectra.dtype)
+            self.spectra[batch_first:batch_last] = spectra
+        self.n_spectra = max(first, last)
+
+        return full and self.bounds is None
+
+    def merge_bins(self):
+        """ merge neighbouring bins into bins twice as long. The bins are full, so the last one
+        (whose peaks are pending) has an even index and becomes the first half of a merged bin """
+        half = self.capacity // 2
+        self.peaks[:half] = merge_peaks(self.peaks[:self.capacity], numpy.arange(0, self.capacity + 1, 2))
+        self.n_peaks = half
+
+        # with short bins the spectra lag behind (and may not have started yet)
+        kept = (self.n_spectra + 1) // 2
+        if kept:
+            self.spectra[:kept] = self.spectra[:self.n_spectra:2]
+        self.n_spectra = kept
+
+        self.samples_per_bin *= 2
+
+    def trim(self):
+        """ drop the samples no longer needed by any bin """
+        keep_from = self.peak_position
+        if self.bounds is None or self.n_spectra < self.image_width:
+            keep_from = min(keep_from, int(self.spectrum_starts(self.n_spectra, self.n_spectra + 1)[0]) - self.half_fft)
+        if keep_from > self.tail_start:
+            self.tail = self.tail[keep_from - self.tail_start:]
+            self.tail_start = keep_from
+
+    def columns(self, peaks, spectra):
+        """ map the bins of a stream of unknown length onto the columns: every column gets the
+        merged peaks of the bins starting in it and the spectrum nearest to its start """
+        seek_points = (numpy.arange(self.image_width + 1) * (self.position / float(self.image_width))).astype(numpy.int64)
+        first_bins = numpy.minimum(seek_points[:-1] // self.samples_per_bin, len(peaks) - 1)
+
+        if numpy.all(numpy.diff(first_bins) > 0):
+            column_peaks = merge_peaks(peaks, numpy.append(first_bins, len(peaks)))
+        else:
+            # columns narrower than a bin (short audio) share the peaks of the bin they are in
+            column_peaks = peaks[first_bins]
+
+        nearest = numpy.rint(seek_points[:-1] / float(self.samples_per_bin * self.stride)).astype(numpy.int64)
+        return column_peaks, spectra[numpy.minimum(nearest, len(spectra) - 1)]
+
+
+def open_stream(input_filename):
+    """ the sound file to stream input_filename (STDIN_FILENAME for stdin) from, and its length if
+    it can be known up front (None otherwise) """
+    if input_filename == STDIN_FILENAME:
+        # libsndfile reads pipes through their file descriptor, for formats that don't need seeking
+        audio_file = sf.SoundFile(sys.stdin.fileno(), 'r', closefd=False)
+        return audio_file, None
+    audio_file = sf.SoundFile(input_filename, 'r')
+    return audio_file, len(audio_file)
+
+
+def create_wave_images_streaming(input_filename, output_filename_w, output_filename_s, image_width, image_height,
+                                 fft_size, progress_callback=None, color_scheme=None, duration_hint=None, stats=None,
+                                 export_filename=None, export_format="binary", export_rows=None):
+    """
+    Like create_wave_images, but reading the audio once, front to back, in blocks of
+    STREAM_BLOCK_SIZE frames, in memory that doesn't grow with its length. input_filename can be
+    STDIN_FILENAME to read from stdin. duration_hint (seconds) is used as the length of streams
+    that don't know theirs, audio past it is left out of the images. Without it, the columns are
+    fitted to the audio once it has all been read. stats is a render_stats.RenderStats to measure the
+    stages into. The export arguments are those of create_wave_images.
+    """
+    try:
+        audio_file, total_frames = open_stream(input_filename)
+    except (RuntimeError, ValueError) as e:
+        raise AudioProcessingException(f"can't stream {input_filename}: {e}")
+
+    try:
+        if total_frames is None and duration_hint:
+            total_frames = max(1, int(round(duration_hint * audio_file.samplerate)))
+
+        processor = AudioProcessor(input_filename, fft_size, numpy.hanning, normalize=False, audio_file=audio_file)
+        processor.stats = stats
+        analyzer = StreamAnalyzer(processor, image_width, total_frames)
+
+        progress_step = max(1, image_width // 100)
+        next_progress = 0
+
+        def read_blocks():
+            while True:
+                with stage(stats, "decode"):
+                    samples = audio_file.read(STREAM_BLOCK_SIZE, dtype='float32')
+                if len(samples) == 0:
+                    return
+                if stats:
+                    stats.count("decode", len(samples), samples.nbytes)
+                # convert to mono by selecting left channel only
+                yield samples[:, 0] if samples.ndim > 1 else samples
+
+        # the next blocks are decoded while this one is analysed
+        with contextlib.closing(prefetched(read_blocks())) as blocks:
+            for samples in blocks:
+                analyzer.feed(samples)
+
+                while progress_callback and total_frames and next_progress < analyzer.n_peaks:
+                    progress_callback(next_progress, image_width)
+                    next_progress += progress_step
+
+        all_peaks, raw_spectra = analyzer.finish()
+    finally:
+        audio_file.close()
+
+    draw_images(processor, all_peaks, raw_spectra, output_filename_w, output_filename_s, image_width, image_height,
+                progress_callback, color_scheme, export_filename=export_filename, export_format=export_format,
+                export_rows=export_rows)
@@ -0,0 +1,52 @@
+# test_progress_json.py
+# wav2png.py --progress-format json: stdout has to stay one JSON object per line, whatever else
+# wav2png.py reports
+
+import json
+import os
+import subprocess
+import sys
+
+import numpy
+import soundfile as sf
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_tone(filename, seconds=0.5, samplerate=44100):
+    t = numpy.arange(int(seconds * samplerate)) / samplerate
+    sf.write(filename, 0.5 * numpy.sin(2 * numpy.pi * 440.0 * t), samplerate)
+
+
+def run_json(*arguments):
+    """ the events wav2png.py writes to stdout, each line parsed on its own """
+    completed = subprocess.run([sys.executable, os.path.join(REPO, "wav2png.py"), "--progress-format", "json"]
+                               + list(arguments), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True, check=True)
+    return [json.loads(line) for line in completed.stdout.splitlines()]
+
+
+def test_jobs_stdout_is_json_lines(tmp_path):
+    files = [str(tmp_path / name) for name in ("a.wav", "b.wav")]
+    for filename in files:
+        write_tone(filename)
+
+    # an even height, whose warning isn't JSON either
+    events = run_json(*files, "-j", "2", "-H", "170", "--cache-dir", str(tmp_path / "cache"))
+
+    names = [event["event"] for event in events]
+    assert names.count("done") == 2
+    summary = next(event for event in events if event["event"] == "summary")
+    assert summary["rendered"] == 2 and summary["failed"] == []
+    assert names[-1] == "cache"
+
+
+def test_directory_stdout_is_json_lines(tmp_path):
+    audio = tmp_path / "audio"
+    audio.mkdir()
+    write_tone(str(audio / "a.wav"))
+
+    run_json(str(audio), "-j", "2")
+    events = run_json(str(audio), "-j", "2")
+
+    assert events == [dict(events[0], event="watch", state="up_to_date", files=1)]
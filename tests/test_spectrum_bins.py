@@ -0,0 +1,34 @@
+# test_spectrum_bins.py
+# the spectra of every samplerate are mapped to frequencies with that samplerate, see
+# processing.spectrum_bins and spectrogram_rows
+
+import numpy
+import soundfile as sf
+
+from processing import AudioProcessor, MAX_FREQUENCY, spectrogram_rows, spectrum_bins
+
+
+def tone_spectrum(tmp_path, samplerate, frequency, fft_size=2048):
+    filename = str(tmp_path / f"tone{samplerate}.wav")
+    t = numpy.arange(samplerate) / samplerate
+    sf.write(filename, 0.5 * numpy.sin(2 * numpy.pi * frequency * t), samplerate)
+    processor = AudioProcessor(filename, fft_size, numpy.hanning, normalize=False)
+    try:
+        return processor.raw_spectra([samplerate // 2])[0]
+    finally:
+        processor.audio_file.close()
+
+
+def test_tone_bin_at_every_samplerate(tmp_path):
+    for samplerate in (44100, 96000, 192000):
+        spectrum = tone_spectrum(tmp_path, samplerate, 5000.0)
+        assert len(spectrum) == spectrum_bins(2048, samplerate)
+        assert abs(numpy.argmax(spectrum) * samplerate / 2048 - 5000.0) <= samplerate / 2048
+
+
+def test_rows_end_at_displayed_band():
+    # at 44.1 kHz the top row, at the Nyquist frequency, is above the last bin
+    for samplerate in (96000, 192000):
+        bin_indices, _ = spectrogram_rows(171, 2048, samplerate)
+        assert len(bin_indices) == 171
+        assert bin_indices[-1] == int(MAX_FREQUENCY / (samplerate / 2.0) * 1025)
@@ -0,0 +1,171 @@
+# tiles.py
+# Zoomable tile pyramids of the waveform and spectrogram, see wav2png.py --tiles
+#
+# The audio is analysed once, at the width of the finest level. Every coarser level is half as
+# wide and reduced from the one below it: peaks by min/max, spectral centroids and spectrogram
+# pixel values by their mean. Each level is cut into tiles of tile_width columns (the last one
+# narrower), which are drawn and encoded on a pool of threads (PIL encodes without holding the
+# GIL). A manifest.json next to the tiles describes the levels, level 0 being the coarsest:
+#
+#   <output_dir>/manifest.json
+#   <output_dir>/waveform/<level>/<tile>.png
+#   <output_dir>/spectrogram/<level>/<tile>.jpg
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from processing import (AudioProcessor, WaveformImage, SpectrogramImage, merge_peaks, ANALYSIS_BLOCK_SIZE,
+                        DRAW_BLOCK_SIZE)
+
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = "manifest.json"
+
+DEFAULT_TILE_WIDTH = 256
+
+
+def analyze_finest_level(processor, image_width, spectrogram=None, progress_callback=None):
+    """
+    Peaks, spectral centroids and (with a SpectrogramImage to take the pixel rows from) spectrum
+    values of the image_width columns of the finest level. Of the raw spectra only the bins the
+    pixel rows are interpolated from are kept until the max level is known, the centroids don't
+    depend on the normalization (see sidecar.build_levels).
+    """
+    samples_per_pixel = processor.nframes / float(image_width)
+    seek_points = (numpy.arange(image_width + 1) * samples_per_pixel).astype(numpy.int64)
+    columns_per_block = max(1, int(ANALYSIS_BLOCK_SIZE // max(samples_per_pixel, processor.fft_size)))
+
+    if spectrogram is not None:
+        used_bins = numpy.unique(numpy.concatenate((spectrogram.bin_indices, spectrogram.bin_indices + 1)))
+        kept_spectra = numpy.empty((image_width, len(used_bins)))
+
+    peaks = numpy.empty((image_width, 2), dtype=numpy.float32)
+    centroids = numpy.empty(image_width)
+    for x0 in range(0, image_width, columns_per_block):
+        x1 = min(x0 + columns_per_block, image_width)
+        if progress_callback:
+            progress_callback(x0, image_width)
+
+        peaks[x0:x1], raw_spectra = processor.analyze_columns(seek_points[x0:x1 + 1])
+        centroids[x0:x1] = processor.spectral_centroids(raw_spectra)
+        if spectrogram is not None:
+            kept_spectra[x0:x1] = raw_spectra[:, used_bins]
+
+    processor.set_max_level(max(0, numpy.abs(peaks).max()))
+
+    if spectrogram is None:
+        return peaks, centroids, None
+
+    values = numpy.empty((image_width, len(spectrogram.bin_indices)))
+    n_bins = processor.n_bins
+    for x0 in range(0, image_width, DRAW_BLOCK_SIZE):
+        block = kept_spectra[x0:x0 + DRAW_BLOCK_SIZE]
+        db_spectra = numpy.zeros((len(block), n_bins))
+        db_spectra[:, used_bins] = processor.db_spectra(processor.scale * block)
+        values[x0:x0 + DRAW_BLOCK_SIZE] = spectrogram.spectrum_values(db_spectra)
+
+    return peaks, centroids, values
+
+
+def reduce_level(peaks, centroids, values):
+    """ the level half as wide: pairs of columns (and the last one on its own if there's an odd
+    number of them) merged """
+    boundaries = numpy.append(numpy.arange(0, len(peaks), 2), len(peaks))
+    counts = numpy.diff(boundaries)
+
+    reduced_peaks = merge_peaks(peaks, boundaries)
+    reduced_centroids = numpy.add.reduceat(centroids, boundaries[:-1]) / counts
+    reduced_values = None
+    if values is not None:
+        reduced_values = numpy.add.reduceat(values, boundaries[:-1], axis=0) / counts[:, numpy.newaxis]
+    return reduced_peaks, reduced_centroids, reduced_values
+
+
+def draw_waveform_tile(filename, peaks, centroids, x0, x1, image_height, color_scheme):
+    """
+    Draw the columns x0..x1 of a level. The columns on either side are drawn too and cut off again,
+    so the joins between columns continue across tiles like they do within an image.
+    """
+    first = max(0, x0 - 1)
+    last = min(len(peaks), x1 + 1)
+
+    waveform = WaveformImage(last - first, image_height, color_scheme)
+    waveform.draw_columns(0, peaks[first:last], centroids[first:last])
+    waveform.pixels = numpy.ascontiguousarray(waveform.pixels[:, x0 - first:x1 - first])
+    waveform.save(filename)
+
+
+def draw_spectrogram_tile(filename, values, x0, x1, image_height, fft_size, color_scheme, samplerate):
+    spectrogram = SpectrogramImage(x1 - x0, image_height, fft_size, color_scheme, samplerate)
+    spectrogram.draw_values(0, values[x0:x1])
+    spectrogram.save(filename)
+
+
+def create_tile_pyramid(input_filename, output_dir, image_width, image_height, fft_size, tile_width=DEFAULT_TILE_WIDTH,
+                        progress_callback=None, color_scheme=None, spectrogram=True, workers=None):
+    """
+    Write the tile pyramid of input_filename to output_dir, the finest level being image_width
+    columns wide, and return the manifest. workers is the number of threads drawing and encoding
+    tiles (os.cpu_count() if None).
+    """
+    processor = AudioProcessor(input_filename, fft_size, numpy.hanning, normalize=False)
+    try:
+        spectrogram_rows = SpectrogramImage(1, image_height, fft_size, color_scheme, processor.samplerate) \
+            if spectrogram else None
+        level = analyze_finest_level(processor, image_width, spectrogram_rows, progress_callback)
+    finally:
+        processor.audio_file.close()
+
+    # finest first, the manifest numbers them the other way around
+    levels = [level]
+    while len(levels[-1][0]) > tile_width:
+        levels.append(reduce_level(*levels[-1]))
+    levels.reverse()
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "tile_width": tile_width,
+        "tile_height": image_height,
+        "fft_size": fft_size,
+        "samplerate": processor.samplerate,
+        "frames": processor.nframes,
+        "waveform": "waveform/{level}/{tile}.png",
+        "spectrogram": "spectrogram/{level}/{tile}.jpg" if spectrogram else None,
+        "levels": [],
+    }
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        futures = []
+        for number, (peaks, centroids, values) in enumerate(levels):
+            width = len(peaks)
+            n_tiles = -(-width // tile_width)
+            manifest["levels"].append({"level": number, "width": width, "tiles": n_tiles,
+                                       "samples_per_pixel": processor.nframes / float(width)})
+
+            for kind in ("waveform", "spectrogram") if spectrogram else ("waveform",):
+                os.makedirs(os.path.join(output_dir, kind, str(number)), exist_ok=True)
+
+            for tile in range(n_tiles):
+                x0, x1 = tile * tile_width, min((tile + 1) * tile_width, width)
+                futures.append(executor.submit(
+                    draw_waveform_tile, os.path.join(output_dir, manifest["waveform"].format(level=number, tile=tile)),
+                    peaks, centroids, x0, x1, image_height, color_scheme))
+                if spectrogram:
+                    futures.append(executor.submit(
+                        draw_spectrogram_tile,
+                        os.path.join(output_dir, manifest["spectrogram"].format(level=number, tile=tile)),
+                        values, x0, x1, image_height, fft_size, color_scheme, processor.samplerate))
+
+        # raise the first error, if any
+        for future in futures:
+            future.result()
+
+    with open(os.path.join(output_dir, MANIFEST_FILENAME), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    if progress_callback:
+        progress_callback(image_width, image_width)
+
+    return manifest
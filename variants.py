@@ -0,0 +1,134 @@
+# variants.py
+# Several images of one file, at different sizes and in different color schemes, from a single
+# analysis of its audio, see wav2png.py --variant
+#
+# The audio is analysed once, at the width of the widest output. Narrower outputs are reduced from
+# those columns like the levels of tiles.py are: peaks by min/max, spectral centroids and
+# spectrogram pixel values by their mean, an output column taking the analysis columns that start
+# within it. The outputs as wide as the widest one are exactly what create_wave_images renders,
+# narrower ones differ slightly from it (their spectra being the mean of the frames of several
+# columns rather than the frame at the start of theirs). Spectrogram values are computed once per
+# height, the color scheme only picks the palette they are drawn with.
+
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from processing import (AudioProcessor, WaveformImage, SpectrogramImage, analyze_audio, merge_peaks,
+                        DRAW_BLOCK_SIZE)
+from render_stats import stage
+
+# an image to render: image is "waveform" or "spectrogram", the file format follows the extension
+# of filename (like .png for waveforms and .jpg for spectrograms)
+OutputSpec = namedtuple("OutputSpec", ["filename", "image_width", "image_height", "color_scheme", "image"],
+                        defaults=(None, "waveform"))
+
+IMAGES = ("waveform", "spectrogram")
+
+
+def column_boundaries(n_columns, image_width):
+    """ the first of the n_columns analysis columns each of image_width (at most n_columns) output
+    columns starts at, and n_columns: the first one starting at or after the output column does """
+    return -(-numpy.arange(image_width + 1) * n_columns // image_width)
+
+
+def reduce_columns(peaks, centroids, values, image_width):
+    """ peaks, centroids and spectrogram values (a dict by height) of image_width columns, merged
+    from the len(peaks) given """
+    if image_width == len(peaks):
+        return peaks, centroids, values
+    boundaries = column_boundaries(len(peaks), image_width)
+    counts = numpy.diff(boundaries)
+
+    reduced_peaks = merge_peaks(peaks, boundaries)
+    reduced_centroids = numpy.add.reduceat(centroids, boundaries[:-1]) / counts
+    reduced_values = {height: numpy.add.reduceat(height_values, boundaries[:-1], axis=0) / counts[:, numpy.newaxis]
+                      for height, height_values in values.items()}
+    return reduced_peaks, reduced_centroids, reduced_values
+
+
+def analyze_columns(processor, image_width, spectrograms, progress_callback=None, stats=None):
+    """
+    Peaks, spectral centroids and spectrogram values of the image_width columns of the audio of
+    processor. spectrograms is a dict of a SpectrogramImage by height to take the pixel rows from,
+    values is one of the values of all columns by height.
+    """
+    all_peaks, raw_spectra = analyze_audio(processor, image_width, progress_callback)
+
+    centroids = numpy.empty(image_width)
+    values = {height: numpy.empty((image_width, len(spectrogram.bin_indices)))
+              for height, spectrogram in spectrograms.items()}
+    for x0 in range(0, image_width, DRAW_BLOCK_SIZE):
+        with stage(stats, "features"):
+            centroids[x0:x0 + DRAW_BLOCK_SIZE], db_spectra = processor.spectrum_features(
+                raw_spectra[x0:x0 + DRAW_BLOCK_SIZE])
+        with stage(stats, "draw_spectrogram"):
+            for height, spectrogram in spectrograms.items():
+                values[height][x0:x0 + DRAW_BLOCK_SIZE] = spectrogram.spectrum_values(db_spectra)
+
+    return all_peaks, centroids, values
+
+
+def create_variant_images(input_filename, specs, fft_size=2048, progress_callback=None, stats=None, workers=None):
+    """
+    Render the images of input_filename that specs (OutputSpecs) describe, analysing the audio once.
+    progress_callback is called like by create_wave_images, with the columns of the widest image.
+    The images are encoded on workers threads (os.cpu_count() if None).
+    """
+    specs = [OutputSpec(*spec) for spec in specs]
+    for spec in specs:
+        if spec.image not in IMAGES:
+            raise ValueError(f"{spec.filename}: image must be one of {', '.join(IMAGES)}, not {spec.image!r}")
+    if not specs:
+        return
+    image_width = max(spec.image_width for spec in specs)
+
+    processor = AudioProcessor(input_filename, fft_size, numpy.hanning, normalize=False)
+    processor.stats = stats
+    try:
+        images = []
+        rows = {}
+        for spec in specs:
+            if spec.image == "spectrogram":
+                image = SpectrogramImage(spec.image_width, spec.image_height, fft_size, spec.color_scheme,
+                                         processor.samplerate)
+                # the values of a height are the same in every color scheme, see spectrum_values
+                rows.setdefault(spec.image_height, image)
+            else:
+                image = WaveformImage(spec.image_width, spec.image_height, spec.color_scheme)
+            images.append(image)
+
+        columns = {image_width: analyze_columns(processor, image_width, rows, progress_callback, stats)}
+    finally:
+        processor.audio_file.close()
+
+    for spec, image in zip(specs, images):
+        if spec.image_width not in columns:
+            columns[spec.image_width] = reduce_columns(*columns[image_width], spec.image_width)
+        peaks, centroids, values = columns[spec.image_width]
+
+        with stage(stats, "draw_" + spec.image):
+            for x0 in range(0, spec.image_width, DRAW_BLOCK_SIZE):
+                if spec.image == "spectrogram":
+                    image.draw_values(x0, values[spec.image_height][x0:x0 + DRAW_BLOCK_SIZE])
+                else:
+                    image.draw_columns(x0, peaks[x0:x0 + DRAW_BLOCK_SIZE], centroids[x0:x0 + DRAW_BLOCK_SIZE])
+
+    if progress_callback:
+        progress_callback(image_width, image_width)
+
+    def save(spec, image):
+        with stage(stats, "encode_" + spec.image):
+            image.save(spec.filename)
+
+    # PIL encodes without holding the GIL
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        for future in [executor.submit(save, spec, image) for spec, image in zip(specs, images)]:
+            future.result()
+
+    if stats:
+        # numbered, there may be several images of each kind
+        for i, spec in enumerate(specs):
+            stats.output(f"encode_{spec.image}_{i}", spec.filename, os.path.getsize(spec.filename))
@@ -0,0 +1,114 @@
+# watch_folder.py
+# Finding the audio files in directory trees, and remembering which of them were rendered already,
+# for wav2png.py given directories (and --watch)
+#
+# --include and --exclude patterns are fnmatch patterns, matched case insensitively against the
+# name of a file or directory, or against its path relative to the directory given if they contain
+# a "/". Excluded directories aren't entered, nor are symbolic links to directories.
+#
+# The index (INDEX_FILENAME in the output directory, or the first directory given, by default) is
+# a JSON file: the settings the images were rendered with, and the size and modification time of
+# every file rendered, by absolute path. A file is rendered again when either of them changes, and
+# all files are when the settings do.
+
+import fnmatch
+import json
+import os
+
+# the files rendered without --include, what libsndfile reads
+AUDIO_PATTERNS = ("*.wav", "*.wave", "*.w64", "*.rf64", "*.flac", "*.ogg", "*.oga", "*.opus", "*.mp3", "*.aif",
+                  "*.aiff", "*.aifc", "*.au", "*.snd", "*.caf")
+
+INDEX_FILENAME = ".wav2png_index.json"
+INDEX_VERSION = 1
+
+
+def matches(relative_path, patterns):
+    """ whether relative_path ("/" separated) or its last part matches any of patterns """
+    relative_path = relative_path.lower()
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatchcase(relative_path if "/" in pattern else name, pattern.lower())
+               for pattern in patterns)
+
+
+def walk_audio_files(root, include=AUDIO_PATTERNS, exclude=(), skip=()):
+    """
+    Yield (path, relative path, stat) of every file below the directory root that matches include
+    and not exclude, the files of a directory (by name) before those of its subdirectories. The
+    directories in skip aren't entered (the output directory, if it is inside root). Files and
+    directories that vanish or can't be read while walking are left out.
+    """
+    skip = {os.path.normcase(os.path.realpath(directory)) for directory in skip}
+    # walked depth first without recursion, trees may be deep
+    directories = [(root, "")]
+    while directories:
+        directory, relative = directories.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            entry_relative = relative + entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not matches(entry_relative, exclude) and \
+                            not (skip and os.path.normcase(os.path.realpath(entry.path)) in skip):
+                        subdirectories.append((entry.path, entry_relative + "/"))
+                elif entry.is_file() and matches(entry_relative, include) and not matches(entry_relative, exclude):
+                    yield entry.path, entry_relative, entry.stat()
+            except OSError:
+                continue
+        directories.extend(reversed(subdirectories))
+
+
+def file_signature(stat):
+    """ what a file being changed changes """
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class RenderIndex:
+    """
+    The signatures (see file_signature) of the files rendered with settings (a dict of JSON values),
+    loaded from and saved to filename. Starts out empty if there is no such file yet, or if it was
+    written with other settings.
+    """
+
+    def __init__(self, filename, settings):
+        self.filename = filename
+        self.settings = settings
+        self.files = {}
+        self.changed = False
+        try:
+            with open(filename) as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION and index.get("settings") == settings:
+                self.files = index["files"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def is_current(self, path, stat):
+        """ whether path was rendered as it is now """
+        return self.files.get(path) == file_signature(stat)
+
+    def mark(self, path, stat):
+        self.files[path] = file_signature(stat)
+        self.changed = True
+
+    def keep_only(self, paths):
+        """ forget the files not in paths (deleted ones) """
+        for path in [path for path in self.files if path not in paths]:
+            del self.files[path]
+            self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        temporary_filename = self.filename + ".tmp"
+        with open(temporary_filename, "w") as f:
+            json.dump({"version": INDEX_VERSION, "settings": self.settings, "files": self.files}, f,
+                      separators=(",", ":"))
+        os.replace(temporary_filename, self.filename)
+        self.changed = False
@@ -23,8 +23,13 @@
 
 
 try:
+    import time
+    # for --startup-report
+    STARTED = time.perf_counter()
     import argparse
-    from processing import create_wave_images, AudioProcessingException
+    import importlib
+    import json
+    import os
     import sys
 
 except Exception as e:
@@ -37,35 +42,541 @@ except Exception as e:
     sys.exit(1)
 
 
-def progress_callback(position, width):
-    percentage = (position * 100) // width
-    if position % (width // 10) == 0:
-        sys.stdout.write(str(percentage) + "% ")
-        sys.stdout.flush()
+# the modules rendering needs, in the order load_processing imports (and times) them
+RENDER_MODULES = ("numpy", "soundfile", "PIL.Image", "processing")
+# what load_processing times selecting the FFT backend (see fft_backend.py) as, after the imports
+FFT_BACKEND_PROBE = "the FFT backend"
+# seconds from starting wav2png.py to rendering the first file that --startup-report still calls fast
+STARTUP_BUDGET = 0.5
+
+import_times = {}
+
+# the analysis data of --export, see export.py
+EXPORT_SUFFIXES = {"binary": "_data.a2d", "json": "_data.json"}
+# files rendered between two saves of the index of the directories given, see main_folders
+INDEX_SAVE_EVERY = 200
+
+
+def load_processing():
+    """ the processing module, imported when the first file is rendered, so runs that render nothing
+    (--help, all files cached) don't wait for numpy, soundfile and PIL """
+    for name in RENDER_MODULES:
+        if name not in import_times:
+            start = time.perf_counter()
+            importlib.import_module(name)
+            import_times[name] = time.perf_counter() - start
+    if FFT_BACKEND_PROBE not in import_times:
+        # the CPU probe and, for scipy.fft, its import: done here rather than by the first AudioProcessor,
+        # so --startup-report counts it
+        start = time.perf_counter()
+        sys.modules["fft_backend"].fft_backend()
+        import_times[FFT_BACKEND_PROBE] = time.perf_counter() - start
+    return sys.modules["processing"]
+
+
+def report(args, event, text, **fields):
+    """ print text, or with --progress-format json emit the event (see progress.py) with fields
+    instead, so stdout stays one JSON object per line """
+    if args.progress_format == "json":
+        from progress import write_json_line
+        write_json_line(dict({"event": event}, **fields, time=time.time()))
+    else:
+        print(text)
+
+
+def diagnostics(args):
+    """ the stream of the reports asked for besides the progress (--profile, --startup-report...):
+    stdout, or stderr with --progress-format json """
+    return sys.stderr if args.progress_format == "json" else sys.stdout
+
+
+def report_startup(args):
+    """ with --startup-report, print (once) how long it took to get to the first file and what for """
+    if not args.startup_report:
+        return
+    args.startup_report = False
+    total = time.perf_counter() - STARTED
+    stream = diagnostics(args)
+    print(f"startup: {total:.3f}s, budget {STARTUP_BUDGET:.3f}s" + (" (over budget)" if total > STARTUP_BUDGET else ""),
+          file=stream)
+    for name, seconds in import_times.items():
+        print(f"\timport {name}: {seconds:.3f}s", file=stream)
+    print(f"\tthe rest: {total - sum(import_times.values()):.3f}s", file=stream)
+    stream.flush()
+
+
+def audio_frames(input_file):
+    """ length of input_file in frames, None if it can't be told without decoding it """
+    if input_file == "-":
+        return None
+    try:
+        import soundfile
+        return soundfile.info(input_file).frames
+    except Exception:
+        return None
+
+
+def file_progress(args, input_file):
+    """ the progress callback of rendering input_file: the percentages, or with --progress-format json
+    the events of progress.ProgressEvents """
+    if args.progress_format == "json":
+        from progress import ProgressEvents
+        return ProgressEvents(input_file, audio_frames(input_file))
+    from progress import TextProgress
+    return TextProgress()
+
+
+def print_batch_result(result, args):
+    if args.progress_format == "json":
+        file_progress(args, result.job.input_file).finish(result.error, result.seconds)
+        return
+    if result.error:
+        print(f"{result.job.input_file}: FAILED ({result.error})")
+    else:
+        print(f"{result.job.input_file}: done in {result.seconds:.2f}s")
+    sys.stdout.flush()
+
+
+def profiling(args):
+    return args.profile or args.stats_json
+
+
+def record_stats(args, input_file, stats, error=None):
+    """ print (with --profile) and collect (with --stats-json) the stats of a file, a dict as
+    returned by RenderStats.as_dict """
+    if args.profile:
+        from render_stats import format_stats
+        print(format_stats(stats), file=diagnostics(args))
+    if args.stats_json:
+        args.collected_stats.append(dict(stats, file=input_file, error=error))
+        # written after every file, so the stats of the files done survive a crash
+        temporary = args.stats_json + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"files": args.collected_stats}, f, indent=1)
+        os.replace(temporary, args.stats_json)
+
+
+def output_base(input_file, args):
+    """ what the outputs of input_file are named after: the file itself or, with --output-dir, its
+    path relative to the directory it was found in (just its name if it was given on its own) in
+    the output directory """
+    # images of stdin ("-") are named stdin_w.png and stdin_s.jpg
+    if input_file == "-":
+        return "stdin"
+    if not args.output_dir:
+        return input_file
+    return os.path.join(args.output_dir, args.relative_paths.get(input_file, os.path.basename(input_file)))
+
+
+def variant_spec(text):
+    """ a --variant: WIDTHxHEIGHT, optionally followed by :SCHEME, as [width, height, scheme or None] """
+    size, _, scheme = text.partition(":")
+    try:
+        width, height = (int(n) for n in size.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} is not WIDTHxHEIGHT or WIDTHxHEIGHT:SCHEME")
+    if width < 1 or height < 2:
+        raise argparse.ArgumentTypeError(f"{text!r} is too small")
+    return [width, height, scheme or None]
+
+
+def variant_suffix(variant):
+    """ what the images of a --variant are named after, e.g. _120x41_Cyberpunk """
+    width, height, scheme = variant
+    return f"_{width}x{height}" + (f"_{scheme}" if scheme else "")
+
+
+def variant_specs(outputs, args):
+    """ the variants.OutputSpecs of rendering the --variant outputs (see output_files) """
+    specs = []
+    for variant in args.variants:
+        width, height, scheme = variant
+        suffix = variant_suffix(variant)
+        specs.append((outputs[suffix + "_w.png"], width, height, scheme or args.color_scheme, "waveform"))
+        if not args.waveform_only:
+            specs.append((outputs[suffix + "_s.jpg"], width, height, scheme or args.color_scheme, "spectrogram"))
+    return specs
+
+
+def output_files(input_file, args):
+    """ the images to create for input_file, by suffix """
+    base = output_base(input_file, args)
+    outputs = {}
+    if args.variants:
+        for variant in args.variants:
+            suffix = variant_suffix(variant)
+            outputs[suffix + "_w.png"] = base + suffix + "_w.png"
+            if not args.waveform_only:
+                outputs[suffix + "_s.jpg"] = base + suffix + "_s.jpg"
+        return outputs
+    if not args.export_only:
+        outputs["_w.png"] = base + "_w.png"
+        if not args.waveform_only:
+            outputs["_s.jpg"] = base + "_s.jpg"
+    if args.export or args.export_only:
+        suffix = EXPORT_SUFFIXES[args.export_format]
+        outputs[suffix] = base + suffix
+    return outputs
+
+
+def cache_lookup(cache, input_file, args):
+    """ place the cached images of input_file if there are any, returns (hit, key) """
+    outputs = output_files(input_file, args)
+    exporting = args.export or args.export_only
+    try:
+        key = cache.key(input_file, args.width, args.height, args.fft_size, args.color_scheme, outputs,
+                        args.export_format if exporting else None,
+                        (0 if args.waveform_only else args.export_rows) if exporting else None)
+    except OSError:
+        # unreadable files are left to fail (and be reported) when rendering
+        return False, None
+    if cache.fetch(key, outputs):
+        return True, key
+    cache.release(outputs)
+    return False, key
+
+
+def main_batch(args, cache=None, file_callback=None):
+    load_processing()
+    # imported here so the single process path doesn't pay for it
+    from batch import RenderJob, run_batch
+
+    jobs = []
+    keys = {}
+    for input_file in args.files:
+        if cache and not args.variants:
+            hit, keys[input_file] = cache_lookup(cache, input_file, args)
+            if hit:
+                if args.progress_format == "json":
+                    file_progress(args, input_file).cached()
+                else:
+                    print(f"{input_file}: cached")
+                if file_callback:
+                    file_callback(input_file, False)
+                continue
+        outputs = output_files(input_file, args)
+        if args.variants:
+            # the size of the widest variant, what the memory of the job is estimated for
+            width, height = max((variant[0], variant[1]) for variant in args.variants)
+            jobs.append(RenderJob(input_file, None, None, width, height, args.fft_size, args.color_scheme,
+                                  bool(profiling(args)), variants=variant_specs(outputs, args)))
+            continue
+        jobs.append(RenderJob(input_file, outputs.get("_w.png"), outputs.get("_s.jpg"), args.width, args.height,
+                              args.fft_size, args.color_scheme, bool(profiling(args)),
+                              outputs.get(EXPORT_SUFFIXES[args.export_format]), args.export_format,
+                              0 if args.waveform_only else args.export_rows))
+    max_memory = args.max_memory * 1024 * 1024 if args.max_memory else None
+
+    def result_callback(result):
+        print_batch_result(result, args)
+        if result.stats:
+            record_stats(args, result.job.input_file, result.stats, result.error)
+        if cache and not result.error and keys.get(result.job.input_file):
+            cache.store(keys[result.job.input_file], output_files(result.job.input_file, args))
+        if file_callback:
+            file_callback(result.job.input_file, bool(result.error))
+
+    report_startup(args)
+    start = time.perf_counter()
+    results = run_batch(jobs, args.jobs, max_memory, result_callback)
+    failed = [result for result in results if result.error]
+
+    elapsed = time.perf_counter() - start
+    failed_files = [result.job.input_file for result in failed]
+    report(args, "summary", "".join([f"{len(results) - len(failed)} files rendered, {len(failed)} failed, "
+                                     f"in {elapsed:.2f}s on {args.jobs} processes"] +
+                                    [f"\n\tfailed: {input_file}" for input_file in failed_files]),
+           rendered=len(results) - len(failed), failed=failed_files, elapsed=elapsed, processes=args.jobs)
+    return failed_files
+
+
+def render_files(args, cache=None, file_callback=None):
+    """ render args.files, returns the ones that failed. file_callback is called with each file and
+    whether it failed once it is done (or found in the cache) """
+    if args.output_dir:
+        for directory in {os.path.dirname(output_base(input_file, args)) for input_file in args.files}:
+            os.makedirs(directory, exist_ok=True)
+    if args.jobs > 1 and not args.stream and not args.tiles:
+        return main_batch(args, cache, file_callback)
+    return main_serial(args, cache, file_callback)
+
+
+def render_settings(args):
+    """ the arguments the images depend on, the index of main_folders is only used with the same ones """
+    settings = {name: getattr(args, name) for name in (
+        "width", "height", "fft_size", "color_scheme", "waveform_only", "tiles", "tile_width", "export",
+        "export_only", "export_format", "export_rows", "variants")}
+    settings["output_dir"] = args.output_dir and os.path.abspath(args.output_dir)
+    return settings
+
+
+def find_inputs(roots, args):
+    """ (path, stat) of the audio files below the directories in roots and of the files in it, the
+    paths found in directories relative to them are put in args.relative_paths """
+    from watch_folder import walk_audio_files
+
+    skip = [args.output_dir] if args.output_dir else []
+    for root in roots:
+        if not os.path.isdir(root):
+            try:
+                yield root, os.stat(root)
+            except OSError:
+                # missing files are reported once rendering them fails
+                yield root, None
+            continue
+        for path, relative, stat in walk_audio_files(root, args.include, args.exclude, skip):
+            args.relative_paths[path] = relative
+            yield path, stat
+
+
+def main_folders(args, cache=None):
+    """
+    Render the audio files below the directories given (and the files given) that weren't rendered
+    yet, or changed since they were, according to the index (see watch_folder.RenderIndex). With
+    --watch, look for new and changed files again every --watch-interval seconds. There a file is
+    only rendered once it stopped changing (has been the same for a poll, or was last modified
+    longer ago than that), so files that are still being written are left alone. Returns the files
+    that failed to render.
+    """
+    from watch_folder import RenderIndex, INDEX_FILENAME, file_signature
+
+    roots = [os.path.abspath(path) for path in args.files]
+    index_filename = args.index or os.path.join(
+        args.output_dir or next((root for root in roots if os.path.isdir(root)), os.path.dirname(roots[0])),
+        INDEX_FILENAME)
+    index = RenderIndex(index_filename, render_settings(args))
+    # signatures of the files seen changing in the last poll, and of those that failed to render.
+    # Failed files are tried again once they change, or when wav2png.py is started again
+    changing = {}
+    failed = {}
+
+    def save_state():
+        """ what was rendered, so it isn't again after a crash, and the cache within its size """
+        index.save()
+        if cache:
+            cache.evict()
+            cache.save()
+
+    if args.watch:
+        import signal
+        # stopped (by service managers) like with Ctrl+C
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        while True:
+            seen = set()
+            to_render = []
+            now = time.time()
+            for path, stat in find_inputs(roots, args):
+                seen.add(path)
+                signature = stat and file_signature(stat)
+                if path in failed and failed[path] == signature:
+                    continue
+                if stat is not None:
+                    if index.is_current(path, stat):
+                        continue
+                    if args.watch and changing.get(path) != signature and now - stat.st_mtime < args.watch_interval:
+                        changing[path] = signature
+                        continue
+                    changing.pop(path, None)
+                to_render.append((path, stat))
+            index.keep_only(seen)
+
+            if to_render and args.watch:
+                report(args, "watch", f"{time.strftime('%Y-%m-%d %H:%M:%S')}: {len(to_render)} new or changed files",
+                       state="changed", files=len(to_render))
+            elif not to_render and not args.watch:
+                report(args, "watch", f"all {len(seen)} files are up to date", state="up_to_date", files=len(seen))
+            if to_render:
+                # all of them at once, on one pool of --jobs processes
+                args.files = [path for path, _ in to_render]
+                file_stats = dict(to_render)
+                done = 0
+
+                def file_done(path, file_failed):
+                    nonlocal done
+                    stat = file_stats[path]
+                    if file_failed or stat is None:
+                        failed[path] = stat and file_signature(stat)
+                    else:
+                        index.mark(path, stat)
+                        failed.pop(path, None)
+                    done += 1
+                    if done % INDEX_SAVE_EVERY == 0:
+                        save_state()
+
+                render_files(args, cache, file_done)
+            save_state()
+
+            if not args.watch:
+                break
+            sys.stdout.flush()
+            time.sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        report(args, "watch", "stopped watching", state="stopped")
+    finally:
+        index.save()
+    return list(failed)
 
 
 def main(args):
+    """ render what args asks for, returns the files that failed """
+    args.collected_stats = []
+    args.relative_paths = {}
+    cache = None
+    if args.cache_dir:
+        from render_cache import RenderCache
+        max_size = args.cache_max_size * 1024 * 1024 if args.cache_max_size else None
+        cache = RenderCache(args.cache_dir, max_size, args.cache_link)
+
+    try:
+        if args.watch or any(os.path.isdir(input_file) for input_file in args.files):
+            return main_folders(args, cache)
+        return render_files(args, cache)
+    finally:
+        if cache:
+            cache.close()
+            report(args, "cache", cache.statistics(), hits=cache.hits, misses=cache.misses, evicted=cache.evicted)
+        # if no file was rendered
+        report_startup(args)
+
+
+def finish_file(args, cache, input_file, key, outputs, stats, saved, error, progress):
+    """ once the images of input_file are saved (saved being the future of that, if they are saved in
+    the background), cache them and report on the file. Returns whether saving them failed """
+    save_failed = False
+    if saved is not None:
+        try:
+            saved.result()
+        except (RuntimeError, OSError) as e:
+            # like a full disk, the images of the other files are still saved
+            error = str(e)
+            save_failed = True
+            if args.progress_format != "json":
+                print(f"Error saving the images of {input_file}: {e}")
+    if cache and key and not error:
+        cache.store(key, outputs)
+    if args.progress_format == "json":
+        progress.finish(error)
+
+    if stats:
+        record_stats(args, input_file, stats.as_dict(), error)
+
+    if args.report_savings and input_file != "-":
+        # time the normalization pass that used to run before the analysis
+        start = time.perf_counter()
+        load_processing().get_max_level(input_file)
+        print(f"\tskipped normalization pass: {time.perf_counter() - start:.3f}s", file=diagnostics(args))
+    return save_failed
+
+
+def main_serial(args, cache=None, file_callback=None):
+    encoder = None
+    if len(args.files) > 1 and not profiling(args) and not args.report_savings:
+        from concurrent.futures import ThreadPoolExecutor
+        # the images of a file are encoded and saved while the next one is decoded and analysed. Not
+        # when reporting on every file, so the stats and reports of a file are its own and in order
+        encoder = ThreadPoolExecutor(max_workers=1)
+    # the file whose images are still being saved, the arguments of finish_file
+    pending = None
+    failed = []
+
+    def finish(pending):
+        input_file, error = pending[0], pending[5]
+        save_failed = finish_file(args, cache, *pending)
+        if save_failed:
+            failed.append(input_file)
+        if file_callback:
+            file_callback(input_file, save_failed or error is not None)
+
     # process all files so the user can use wildcards like *.wav
     for input_file in args.files:
 
-        output_file_w = input_file + "_w.png"
-        output_file_s = input_file + "_s.jpg"
+        outputs = output_files(input_file, args)
+        output_file_w = outputs.get("_w.png")
+        output_file_s = outputs.get("_s.jpg")
+        export_file = outputs.get(EXPORT_SUFFIXES[args.export_format])
+        sidecar_file = input_file + ".a2i" if args.sidecar else None
 
-        this_args = (input_file, output_file_w, output_file_s, args.width, args.height, args.fft_size,
-                     progress_callback, args.color_scheme)
+        if pending and pending[0] == input_file:
+            # the same file twice, its images have to be written before they're looked up or written again
+            finish(pending)
+            pending = None
+
+        stats = None
+        if profiling(args):
+            from render_stats import RenderStats
+            stats = RenderStats()
 
-        print(f"processing file {input_file}:\n\t", end="")
+        key = None
+        if cache and not args.tiles and not args.variants:
+            hit, key = cache_lookup(cache, input_file, args)
+            if hit:
+                if args.progress_format == "json":
+                    file_progress(args, input_file).cached()
+                else:
+                    print(f"file {input_file} is cached")
+                if file_callback:
+                    file_callback(input_file, False)
+                continue
 
+        processing = load_processing()
+        report_startup(args)
+        progress = file_progress(args, input_file)
+        if args.progress_format == "json":
+            progress.start()
+        else:
+            print(f"processing file {input_file}:\n\t", end="")
+
+        this_args = (input_file, output_file_w, output_file_s, args.width, args.height, args.fft_size,
+                     progress, args.color_scheme, False, args.file_workers, sidecar_file, stats)
+
+        saved = None
+        error = None
         try:
-            create_wave_images(*this_args)
-        except AudioProcessingException as e:
-            print(f"Error running wav2png: {e}")
-        print("")
+            # the other modes are imported where they are used, so the default path doesn't pay for them
+            if args.tiles:
+                from tiles import create_tile_pyramid
+                create_tile_pyramid(input_file, output_base(input_file, args) + "_tiles", args.width, args.height, args.fft_size,
+                                    args.tile_width, progress, args.color_scheme,
+                                    spectrogram=not args.waveform_only)
+            elif args.variants:
+                from variants import create_variant_images
+                create_variant_images(input_file, variant_specs(outputs, args), args.fft_size, progress, stats)
+            elif args.stream or input_file == "-":
+                from streaming import create_wave_images_streaming
+                create_wave_images_streaming(input_file, output_file_w, output_file_s, args.width, args.height,
+                                             args.fft_size, progress, args.color_scheme,
+                                             args.duration_hint, stats, export_file, args.export_format,
+                                             0 if args.waveform_only else args.export_rows)
+            else:
+                saved = processing.create_wave_images(*this_args, encoder=encoder, export_filename=export_file,
+                                                      export_format=args.export_format,
+                                                      export_rows=0 if args.waveform_only else args.export_rows)
+        except (processing.AudioProcessingException, RuntimeError, OSError) as e:
+            # files that can't be read or decoded (soundfile raises RuntimeErrors), the others are still rendered
+            error = str(e)
+            failed.append(input_file)
+            if args.progress_format != "json":
+                print(f"Error running wav2png: {e}")
+        if args.progress_format != "json":
+            print("")
+
+        if pending:
+            finish(pending)
+        pending = (input_file, key, outputs, stats, saved, error, progress)
+
+    if pending:
+        finish(pending)
+    if encoder:
+        encoder.shutdown()
+    return failed
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument("files", help="files to process", nargs="+")
+    parser.add_argument("files", help="files to process, - for stdin. The audio files below directories (see "
+                                      "--include) are processed unless they were already, see --index", nargs="+")
     parser.add_argument("-w", "--width", type=int, default=500, dest="width",
                         help="image width in pixels")
     parser.add_argument("-H", "--height", type=int, default=171, dest="height",
@@ -75,6 +586,113 @@ if __name__ == '__main__':
     parser.add_argument("-c", "--color_scheme", type=str, default='BleepBloop', dest="color_scheme",
                         help="name of the color scheme to use (one of: 'Freesound2' (default), 'FreesoundBeastWhoosh', "
                              "'Cyberpunk', 'Rainforest', there's more... make your own...)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, dest="jobs",
+                        help="number of files to process in parallel, each in its own process")
+    parser.add_argument("--file-workers", type=int, default=1, dest="file_workers",
+                        help="number of processes to split the analysis of each file across, "
+                             "for long recordings")
+    parser.add_argument("--max-memory", type=int, default=None, dest="max_memory",
+                        help="with --jobs, only start files while the estimated memory of all running ones "
+                             "stays below this many MB")
+    parser.add_argument("--waveform-only", action="store_true", dest="waveform_only",
+                        help="don't create the spectrogram image")
+    parser.add_argument("--sidecar", action="store_true", dest="sidecar",
+                        help="with --waveform-only, keep a <file>.a2i analysis file next to each input, waveforms "
+                             "of any size are then rendered from it without decoding the audio again. Not used "
+                             "(nor created) for spectrograms and --export")
+    parser.add_argument("--cache-dir", type=str, default=None, dest="cache_dir",
+                        help="keep rendered images in this directory, keyed on the audio content and all "
+                             "parameters, and reuse them instead of rendering again")
+    parser.add_argument("--cache-max-size", type=int, default=None, dest="cache_max_size",
+                        help="evict the least recently used images once the cache is larger than this many MB")
+    parser.add_argument("--cache-link", action="store_true", dest="cache_link",
+                        help="hard link images from the cache instead of copying them")
+    parser.add_argument("--stream", action="store_true", dest="stream",
+                        help="read each file once, front to back, in memory that doesn't grow with its length "
+                             "(always on for '-', which reads from stdin)")
+    parser.add_argument("--duration-hint", type=float, default=None, dest="duration_hint",
+                        help="with --stream, the length in seconds of streams that don't know theirs (stdin), "
+                             "audio past it is left out. Without it the columns are fitted to the audio at the end")
+    parser.add_argument("--tiles", action="store_true", dest="tiles",
+                        help="write a zoomable tile pyramid to <file>_tiles instead of single images, --width being "
+                             "the width of its finest level")
+    parser.add_argument("--tile-width", type=int, default=256, dest="tile_width",
+                        help="with --tiles, the width of a tile in pixels")
+    parser.add_argument("--variant", type=variant_spec, action="append", default=[], dest="variants",
+                        help="render the images at this size, WIDTHxHEIGHT, in the color scheme given after a ':' "
+                             "(default --color_scheme), to <file>_<WIDTH>x<HEIGHT>[_<SCHEME>]_w.png and _s.jpg "
+                             "instead of at --width and --height. May be given more than once: the audio is "
+                             "analysed once, at the widest size, the narrower ones are reduced from it. Not with "
+                             "--tiles, --stream or --export, and not cached")
+    parser.add_argument("--export", action="store_true", dest="export",
+                        help="also write the values the images are drawn from (quantized peaks, spectral centroids "
+                             "and spectrogram) to <file>_data.a2d, for drawing them client side. Not with --tiles")
+    parser.add_argument("--export-only", action="store_true", dest="export_only",
+                        help="write only the --export data, no images")
+    parser.add_argument("--export-format", choices=sorted(EXPORT_SUFFIXES), default="binary", dest="export_format",
+                        help="format of the --export data: compact binary (.a2d, see export.py) or JSON (_data.json)")
+    parser.add_argument("--export-rows", type=int, default=None, dest="export_rows",
+                        help="spectrogram rows of the --export data, log spaced like the pixel rows of the "
+                             "spectrogram image (default 64). The image height exports its pixels exactly")
+    parser.add_argument("--output-dir", type=str, default=None, dest="output_dir",
+                        help="write the images to this directory instead of next to the audio, the ones of files "
+                             "found in directories given at the same path relative to it as the audio")
+    parser.add_argument("--include", type=str, action="append", default=None, dest="include",
+                        help="pattern of the files to process below directories (case insensitive, may be given "
+                             "more than once, matches the path relative to the directory given if it contains a "
+                             "'/'). Default: the extensions of the audio formats read")
+    parser.add_argument("--exclude", type=str, action="append", default=[], dest="exclude",
+                        help="pattern of the files and directories to leave out below directories, like --include")
+    parser.add_argument("--index", type=str, default=None, dest="index",
+                        help="the file remembering which files below directories were processed already (and "
+                             "their sizes and modification times), default: .wav2png_index.json in --output-dir "
+                             "or the first directory given. Delete it to process all of them again")
+    parser.add_argument("--watch", action="store_true", dest="watch",
+                        help="keep looking for new and changed files below the directories given, and process "
+                             "them once they are completely written. Stop with Ctrl+C")
+    parser.add_argument("--watch-interval", type=float, default=10.0, dest="watch_interval",
+                        help="with --watch, seconds between looking for new and changed files")
+    parser.add_argument("--progress-format", choices=("text", "json"), default="text", dest="progress_format",
+                        help="how to report progress: percentages, or JSON lines events with the columns done, "
+                             "samples per second, elapsed time and ETA of every file (see progress.py)")
+    parser.add_argument("--fft-backend", choices=("auto", "numpy", "scipy"), default=None, dest="fft_backend",
+                        help="the FFT to compute the spectra with, and print which one is used: numpy.fft or scipy.fft "
+                             "(faster, if installed). Without it, the same as auto: scipy.fft where it is installed, "
+                             "except on CPUs without AVX (see fft_backend.py)")
+    parser.add_argument("--profile", action="store_true", dest="profile",
+                        help="print the time, CPU time, samples and bytes processed of every stage of each file")
+    parser.add_argument("--stats-json", type=str, default=None, dest="stats_json",
+                        help="write the per stage stats of every file to this JSON file")
+    parser.add_argument("--startup-report", action="store_true", dest="startup_report",
+                        help="print how long it took to start rendering the first file, and how much of that "
+                             "went to importing numpy, soundfile, PIL and processing")
+    parser.add_argument("--report-savings", action="store_true", dest="report_savings",
+                        help="after each file, time the separate normalization pass that is no longer needed "
+                             "(decodes the file once more, for measuring only)")
 
     args = parser.parse_args()
-    main(args)
+    if args.export_rows is not None and args.export_rows < 2:
+        parser.error("--export-rows must be at least 2")
+    if args.tiles and (args.export or args.export_only):
+        parser.error("--tiles can't be combined with --export or --export-only")
+    if args.variants and (args.tiles or args.stream or args.export or args.export_only or "-" in args.files):
+        parser.error("--variant can't be combined with --tiles, --stream, --export or - (stdin)")
+    if "-" in args.files and (args.watch or any(os.path.isdir(input_file) for input_file in args.files)):
+        parser.error("- (stdin) can't be processed along with directories or with --watch")
+    if args.include is None:
+        from watch_folder import AUDIO_PATTERNS
+        args.include = list(AUDIO_PATTERNS)
+    if args.fft_backend:
+        # fft_backend.FFT_BACKEND_VARIABLE, set before load_processing selects (and times) the backend.
+        # Worker processes inherit it
+        os.environ["WAV2PNG_FFT_BACKEND"] = args.fft_backend
+        try:
+            load_processing()
+            from fft_backend import describe_backend
+            description = describe_backend()
+        except ImportError as e:
+            parser.error(f"--fft-backend {args.fft_backend}: {e}")
+        if args.progress_format == "text":
+            print(f"FFT backend: {description}")
+    if main(args):
+        sys.exit(1)